@@ -0,0 +1,12 @@
+import os
+
+import django
+
+from .handlers import StreamingASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('ROOT_URLCONF', 'foodgram.urls_async')
+
+# то же, что get_asgi_application(), но с потоковыми ответами вне цикла
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
@@ -0,0 +1,62 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+
+def read_parts(iterator, size):
+    """Части потокового ответа общим объемом не меньше size байт."""
+    parts = []
+    total = 0
+    for part in iterator:
+        parts.append(part)
+        total += len(part)
+        if total >= size:
+            break
+    return parts
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGIHandler, который перебирает потоковые ответы не в цикле событий.
+    Django 3.2 вычитывает streaming_content синхронно прямо в цикле,
+    и генераторы с запросами к базе (выгрузка рецептов, список покупок)
+    падают с SynchronousOnlyOperation. Здесь очередная порция читается
+    в потоке синхронных вью, с тем же соединением с базой, что и у вью.
+    Ответ по-прежнему отдается частями и целиком в памяти не держится.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append((
+                b'Set-Cookie',
+                cookie.output(header='').encode('ascii').strip()
+            ))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+        iterator = iter(response)
+        read = sync_to_async(read_parts, thread_sensitive=True)
+        while True:
+            parts = await read(iterator, self.chunk_size)
+            if not parts:
+                break
+            for part in parts:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from contextvars import ContextVar
+from threading import Lock
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+N_PLUS_ONE_THRESHOLD = getattr(settings, 'METRICS_N_PLUS_ONE_THRESHOLD', 5)
+
+
+class RequestMetrics:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.serializer_started = None
+        self.serializer_sql_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка connection.execute_wrapper: считает запросы и время."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_time += time.perf_counter() - started
+            # шаблон запроса приходит без параметров, поэтому одинаковые
+            # запросы в цикле совпадают строка в строку
+            self.statements[sql] += 1
+
+    def repeated_queries(self):
+        return sum(
+            count for count in self.statements.values()
+            if count >= N_PLUS_ONE_THRESHOLD
+        )
+
+    def server_timing(self, total):
+        parts = [
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serializer;dur={self.serializer_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        repeated = self.repeated_queries()
+        if repeated:
+            parts.append(f'nplusone;desc="{repeated} repeated queries"')
+        return ', '.join(parts)
+
+
+class MetricsRegistry:
+    """
+    Накопительные метрики процесса в текстовом формате Prometheus.
+    Каждый воркер gunicorn ведет свои значения.
+    """
+    fields = (
+        ('requests_total', 'counter', 'Number of requests'),
+        ('request_seconds_sum', 'counter', 'Total request time'),
+        ('db_queries_total', 'counter', 'Number of SQL queries'),
+        ('db_seconds_sum', 'counter', 'Total SQL time'),
+        ('serializer_seconds_sum', 'counter', 'Total serializer time'),
+        ('render_seconds_sum', 'counter', 'Total render time'),
+        ('n_plus_one_total', 'counter', 'Requests with repeated queries'),
+    )
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, view, method, metrics, total):
+        with self._lock:
+            values = self._values[(view, method)]
+            values['requests_total'] += 1
+            values['request_seconds_sum'] += total
+            values['db_queries_total'] += metrics.queries
+            values['db_seconds_sum'] += metrics.sql_time
+            values['serializer_seconds_sum'] += metrics.serializer_time
+            values['render_seconds_sum'] += metrics.render_time
+            values['n_plus_one_total'] += bool(metrics.repeated_queries())
+
+    def render(self):
+        with self._lock:
+            snapshot = {
+                labels: dict(values)
+                for labels, values in self._values.items()
+            }
+        lines = []
+        for name, kind, description in self.fields:
+            lines.append(f'# HELP foodgram_{name} {description}')
+            lines.append(f'# TYPE foodgram_{name} {kind}')
+            for (view, method), values in sorted(snapshot.items()):
+                lines.append(
+                    f'foodgram_{name}{{view="{view}",method="{method}"}} '
+                    f'{values.get(name, 0):g}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def track_queries(alias='default'):
+    """
+    Подключает замеры текущего запроса к соединению потока. Нужна там,
+    где ORM вызывается из пула потоков: соединения у потоков свои.
+    Если замеры уже подключены к этому соединению, ничего не делает.
+    """
+    metrics = current_metrics.get()
+    connection = connections[alias]
+    if metrics is None or metrics in connection.execute_wrappers:
+        return nullcontext()
+    return connection.execute_wrapper(metrics)
+
+
+class MetricsMiddleware:
+    """
+    Считает для каждого запроса число и время SQL-запросов, отмечает
+    повторяющиеся запросы (N+1) и отдает замеры в заголовке
+    Server-Timing. Накопленные значения доступны по адресу /metrics/.
+    Работает и под WSGI, и под ASGI: в асинхронном режиме запросы к базе
+    считаются в потоках пула через track_queries.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # так Django узнает, что middleware асинхронный
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with track_queries():
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        view = metrics.view
+        if view is None and request.resolver_match is not None:
+            view = request.resolver_match.view_name
+        registry.observe(view or 'unknown', request.method, metrics, total)
+        response['Server-Timing'] = metrics.server_timing(total)
+        return response
+
+
+class MetricsMixin:
+    """
+    Добавляет к замерам MetricsMiddleware имя действия вьюсета,
+    время сериализации (без SQL внутри нее) и время рендера ответа.
+    Под ASGI синхронный вьюсет работает в отдельном потоке, поэтому
+    запросы к базе подключаются к замерам здесь же.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with track_queries():
+            return super().dispatch(request, *args, **kwargs)
+
+    def get_serializer(self, *args, **kwargs):
+        metrics = current_metrics.get()
+        if metrics is not None and metrics.serializer_started is None:
+            metrics.serializer_started = time.perf_counter()
+            metrics.serializer_sql_time = metrics.sql_time
+        return super().get_serializer(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        metrics = current_metrics.get()
+        if metrics is None:
+            return response
+        metrics.view = f'{self.basename}-{self.action}'
+        finished = time.perf_counter()
+        if metrics.serializer_started is not None:
+            elapsed = finished - metrics.serializer_started
+            # запросы во время сериализации учтены в db
+            sql_inside = metrics.sql_time - metrics.serializer_sql_time
+            metrics.serializer_time = max(elapsed - sql_inside, 0.0)
+        if hasattr(response, 'add_post_render_callback'):
+            def measure_render(rendered):
+                metrics.render_time = time.perf_counter() - finished
+            response.add_post_render_callback(measure_render)
+        return response
+
+
+def metrics_view(request):
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -24,6 +24,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -33,7 +34,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'foodgram.urls'
+ROOT_URLCONF = os.environ.get('ROOT_URLCONF', 'foodgram.urls')
 
 TEMPLATES = [
     {
@@ -52,6 +53,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
 
 DATABASES = {
     'default': {
@@ -64,13 +66,37 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+RECIPES_CACHE = 'default'
+RECIPES_CACHE_TIMEOUT = int(os.environ.get('RECIPES_CACHE_TIMEOUT', 600))
+
+RECIPES_SEARCH_CONFIG = 'russian'
+RECOMMENDATIONS_SIZE = 20
+RECOMMENDATIONS_NEIGHBORS = 50
+FEED_FANOUT_LIMIT = 10000
+FEED_BACKFILL_SIZE = 50
+
+AUTH_TOKEN_CACHE = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+AUTH_TOKEN_LOCAL_SIZE = 1024
+AUTH_TOKEN_LOCAL_TTL = 10
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 5,
@@ -153,3 +179,8 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_THUMBNAIL_SIZE = (480, 480)
+IMAGE_THUMBNAIL_QUALITY = 80
@@ -0,0 +1,13 @@
+from django.urls import path
+
+from recipes import async_views
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/v1/tags/', async_views.tags_list),
+    path('api/v1/ingredients/', async_views.ingredients_list),
+    path('api/v1/recipes/', async_views.recipes_list),
+    # потоковые ответы (список покупок, выгрузка) остаются синхронными:
+    # Django 3.2 не умеет отдавать асинхронные итераторы
+] + sync_urlpatterns
@@ -1,20 +1,29 @@
 from django.contrib import admin
 
 from .models import (Favorite, Ingredient, MeasureUnit, Recipe, RecipeContent,
-                     Tag)
+                     RecipeTag, Tag)
+
+
+class RecipeTagInline(admin.TabularInline):
+    model = RecipeTag
+    extra = 1
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     """Страница админ. панели рецепов."""
 
+    inlines = (RecipeTagInline,)
+
     list_display = (
         'pk',
         'name',
         'image',
         'text',
         'author',
-        'cooking_time'
+        'cooking_time',
+        'favorites_count',
+        'in_carts_count'
     )
     search_fields = ('name', 'tags', 'author',)
     list_filter = ('tags',)
@@ -0,0 +1,69 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+from foodgram.metrics import track_queries
+
+from .catalog import catalog_response, ingredients_catalog, tags_catalog
+from .search import ingredient_index
+from .views import RecipesViewSet
+
+JSON_PARAMS = {'ensure_ascii': False}
+
+
+def database_sync_to_async(func):
+    """
+    Выполняет синхронный код с ORM в потоке пула, а не в общем потоке
+    синхронных вью, чтобы медленные запросы не блокировали друг друга.
+    Соединение с базой закрывается так же, как в конце обычного запроса.
+    """
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            with track_queries():
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False)
+
+
+def drf_view(view):
+    """
+    Асинхронная обертка над вью DRF. Сериализаторы DRF синхронные,
+    поэтому вью и рендер выполняются в потоке пула. Потоковые ответы
+    сюда не подключаются: их нельзя отдать, не вычитав целиком.
+    """
+    def run(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    async def async_view(request, *args, **kwargs):
+        return await database_sync_to_async(run)(request, *args, **kwargs)
+    async_view.csrf_exempt = True
+    return async_view
+
+
+async def tags_list(request):
+    blob = await database_sync_to_async(tags_catalog.get)()
+    return catalog_response(request, blob)
+
+
+async def ingredients_list(request):
+    name = request.GET.get('name')
+    if not name:
+        blob = await database_sync_to_async(ingredients_catalog.get)()
+        return catalog_response(request, blob)
+    limit = request.GET.get('limit', '')
+    limit = int(limit) if limit.isdigit() else None
+    # версия индекса сверяется с общим кэшем, поэтому в потоке пула
+    data = await database_sync_to_async(ingredient_index.search)(
+        name, limit
+    )
+    return JsonResponse(data, safe=False, json_dumps_params=JSON_PARAMS)
+
+
+recipes_list = drf_view(RecipesViewSet.as_view(
+    {'get': 'list', 'post': 'create'}, basename='recipes', detail=False
+))
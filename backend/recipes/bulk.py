@@ -0,0 +1,493 @@
+import json
+import os
+import shutil
+import time
+import zipfile
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.db import IntegrityError, transaction
+
+from . import feed
+from .cache import LIST_VERSION, bump
+from .catalog import ingredients_catalog, tags_catalog
+from .counters import change_counter
+from .fields import EXTENSIONS, read_header
+from .fulltext import schedule_search_update
+from .images import generate_thumbnail
+from .matching import match_index
+from .models import Recipe, RecipeContent, RecipeTag
+from .storage import content_storage
+
+User = get_user_model()
+
+# файл с рецептами внутри zip-архива, картинки лежат рядом
+NDJSON_NAME = 'recipes.ndjson'
+BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 1000
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class DirectoryImages:
+    """Картинки в каталоге: путь в записи - относительно каталога."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+
+    def open(self, name):
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(
+            path
+        ):
+            return None
+        return open(path, 'rb')
+
+
+class ZipImages:
+    """Картинки из zip-архива: путь в записи - имя файла в архиве."""
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def open(self, name):
+        try:
+            return self.archive.open(name)
+        except KeyError:
+            return None
+
+
+class RecipeImporter:
+    """
+    Импорт рецептов из NDJSON пачками по batch_size строк. Пачка
+    проверяется целиком: тэги и ингредиенты сопоставляются по
+    справочникам в памяти процесса, авторы и занятые названия - одним
+    запросом на пачку. Пачка без ошибок записывается в одной транзакции
+    через bulk_create, пачка с ошибками не записывается совсем.
+    """
+
+    def __init__(self, images=None, author=None, batch_size=BATCH_SIZE):
+        self.images = images
+        self.author = author
+        self.batch_size = batch_size
+
+    def run(self, lines):
+        """Возвращает число созданных рецептов и ошибки по номерам строк."""
+        created = 0
+        errors = []
+        for batch in self.batches(lines):
+            records, batch_errors = self.validate(batch)
+            if not batch_errors:
+                try:
+                    self.write(records)
+                except IntegrityError as error:
+                    batch_errors = [
+                        {'line': record['line'],
+                         'errors': {'non_field_errors': [str(error)]}}
+                        for record in records
+                    ]
+            if batch_errors:
+                errors.extend(batch_errors)
+            else:
+                created += len(records)
+        return {'created': created, 'errors': errors}
+
+    def batches(self, lines):
+        batch = []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            batch.append((number, line))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def catalogs():
+        """Тэги по id и slug, ингредиенты по id и (название, единица)."""
+        tags = {}
+        for tag in tags_catalog.items():
+            tags[tag['id']] = tags[tag['slug']] = tag['id']
+        ingredients = {}
+        for ingredient in ingredients_catalog.items():
+            key = (ingredient['name'], ingredient['measurement_unit'])
+            ingredients[ingredient['id']] = ingredients[key] = (
+                ingredient['id']
+            )
+        return tags, ingredients
+
+    def validate(self, batch):
+        errors = []
+        parsed = []
+        for number, line in batch:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                parsed.append((number, data))
+            else:
+                errors.append({'line': number, 'errors': {
+                    'non_field_errors': ['Ожидается объект JSON.']
+                }})
+        usernames = {
+            data['author'] for _, data in parsed
+            if isinstance(data.get('author'), str)
+        }
+        names = {
+            data['name'] for _, data in parsed
+            if isinstance(data.get('name'), str)
+        }
+        context = {
+            'authors': dict(User.objects.filter(
+                username__in=usernames
+            ).values_list('username', 'id')) if usernames else {},
+            'taken': set(Recipe.objects.filter(
+                name__in=names
+            ).values_list('name', flat=True)) if names else set(),
+            'seen': set(),
+        }
+        context['tags'], context['ingredients'] = self.catalogs()
+        records = []
+        for number, data in parsed:
+            record, record_errors = self.validate_record(data, context)
+            if record_errors:
+                errors.append({'line': number, 'errors': record_errors})
+            else:
+                record['line'] = number
+                records.append(record)
+        errors.sort(key=lambda error: error['line'])
+        return records, errors
+
+    def validate_record(self, data, context):
+        """Проверки и сообщения те же, что у RecipeSerializer."""
+        errors = defaultdict(list)
+        name = data.get('name')
+        max_length = Recipe._meta.get_field('name').max_length
+        if not isinstance(name, str) or not name.strip():
+            errors['name'].append('Укажите название рецепта.')
+        elif len(name) > max_length:
+            errors['name'].append(
+                f'Название длиннее {max_length} символов.'
+            )
+        elif name in context['taken'] or name in context['seen']:
+            errors['name'].append('Рецепт с таким названием уже есть.')
+        text = data.get('text')
+        if not isinstance(text, str) or not text.strip():
+            errors['text'].append('Добавьте описание рецепта.')
+        cooking_time = data.get('cooking_time')
+        if not is_int(cooking_time) or cooking_time < 1:
+            errors['cooking_time'].append(
+                'Время приготовления должно быть больше 0'
+            )
+
+        author = data.get('author')
+        if author is None:
+            author_id = getattr(self.author, 'pk', None)
+            if author_id is None:
+                errors['author'].append('Укажите автора рецепта.')
+        else:
+            author_id = context['authors'].get(author) if isinstance(
+                author, str
+            ) else None
+            if author_id is None:
+                errors['author'].append(f'Автор {author} не найден.')
+
+        tags = data.get('tags')
+        tag_ids = []
+        if not isinstance(tags, list) or not tags:
+            errors['tags'].append('Укажите тэги, пожалуйста.')
+        else:
+            unknown = []
+            for tag in tags:
+                tag_id = context['tags'].get(tag) if isinstance(
+                    tag, (str, int)
+                ) and not isinstance(tag, bool) else None
+                if tag_id is None:
+                    unknown.append(str(tag))
+                elif tag_id not in tag_ids:
+                    tag_ids.append(tag_id)
+            if unknown:
+                errors['tags'].append(
+                    f'Тэги не найдены: {", ".join(unknown)}.'
+                )
+
+        contents = self.validate_contents(
+            data.get('ingredients'), context['ingredients'], errors
+        )
+
+        image = data.get('image')
+        extension = None
+        if not isinstance(image, str) or not image:
+            errors['image'].append('Добавьте картинку.')
+        else:
+            extension, message = self.check_image(image)
+            if message:
+                errors['image'].append(message)
+
+        if errors:
+            return None, dict(errors)
+        context['seen'].add(name)
+        return {
+            'name': name,
+            'text': text,
+            'cooking_time': cooking_time,
+            'author_id': author_id,
+            'tag_ids': tag_ids,
+            'contents': contents,
+            'image': image,
+            'extension': extension,
+        }, None
+
+    @staticmethod
+    def validate_contents(items, ingredients, errors):
+        """Состав рецепта: {id ингредиента: количество}."""
+        if not isinstance(items, list) or not items:
+            errors['ingredients'].append('Добавьте хотя бы 1 ингредиент')
+            return {}
+        contents = {}
+        unknown = []
+        for item in items:
+            if not isinstance(item, dict):
+                errors['ingredients'].append(
+                    'Ингредиент должен быть объектом.'
+                )
+                continue
+            key = item.get('id')
+            label = key
+            if not is_int(key):
+                name = item.get('name')
+                unit = item.get('measurement_unit')
+                key = (name, unit) if isinstance(name, str) and isinstance(
+                    unit, str
+                ) else None
+                label = name
+            ingredient_id = ingredients.get(key)
+            if ingredient_id is None:
+                unknown.append(str(label))
+                continue
+            amount = item.get('amount')
+            if ingredient_id in contents:
+                errors['ingredients'].append(
+                    f'Ингредиенты {label} повторяются, '
+                    'пожалуйста, укажите уникальные.'
+                )
+            elif not is_int(amount) or amount < 1:
+                errors['amount'].append(
+                    f'Количество для ингредиента {label} '
+                    'должно быть больше 0.'
+                )
+            contents[ingredient_id] = amount
+        if unknown:
+            errors['ingredients'].append(
+                f'Ингредиенты не найдены: {", ".join(unknown)}.'
+            )
+        return contents
+
+    def check_image(self, name):
+        """
+        Возвращает (расширение, ошибка). Расширение None - картинка
+        уже есть в хранилище под этим именем и копируется только ссылка.
+        """
+        file = self.images.open(name) if self.images else None
+        if file is None:
+            if (name.startswith('images/') and os.path.normpath(name) == name
+                    and content_storage.exists(name)):
+                return None, None
+            return None, f'Картинка {name} не найдена.'
+        with file:
+            header = read_header(file)
+        if header is None or header[0] not in EXTENSIONS:
+            return None, f'Файл {name} не является картинкой.'
+        image_format, width, height = header
+        max_pixels = getattr(settings, 'IMAGE_MAX_PIXELS', None)
+        if max_pixels and width * height > max_pixels:
+            return None, f'Изображение больше {max_pixels} пикселей.'
+        return EXTENSIONS[image_format], None
+
+    def write(self, records):
+        # хранилище адресуется содержимым: повторная запись того же
+        # файла ничего не создает, лишние файлы удалит clean_media
+        for record in records:
+            if record['extension'] is not None:
+                with self.images.open(record['image']) as file:
+                    record['image'] = content_storage.save(
+                        f'images/import.{record["extension"]}', File(file)
+                    )
+        recipes = [
+            Recipe(
+                name=record['name'],
+                text=record['text'],
+                cooking_time=record['cooking_time'],
+                author_id=record['author_id'],
+                image=record['image']
+            )
+            for record in records
+        ]
+        with transaction.atomic():
+            Recipe.objects.bulk_create(recipes)
+            if recipes and recipes[0].pk is None:
+                # СУБД без RETURNING в bulk_create: id по уникальным именам
+                ids = dict(Recipe.objects.filter(
+                    name__in=[recipe.name for recipe in recipes]
+                ).values_list('name', 'id'))
+                for recipe in recipes:
+                    recipe.pk = ids[recipe.name]
+            RecipeTag.objects.bulk_create([
+                RecipeTag(recipe_id=recipe.pk, tag_id=tag_id)
+                for recipe, record in zip(recipes, records)
+                for tag_id in record['tag_ids']
+            ])
+            RecipeContent.objects.bulk_create([
+                RecipeContent(
+                    recipe_id=recipe.pk,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for recipe, record in zip(recipes, records)
+                for ingredient_id, amount in record['contents'].items()
+            ])
+            published(recipes)
+
+
+def published(recipes):
+    """
+    То, что для одного рецепта делают сигналы post_save: bulk_create
+    их не отправляет. Все выполняется пачкой после фиксации.
+    """
+    ids = [recipe.pk for recipe in recipes]
+    bump(LIST_VERSION)
+    schedule_search_update(ids)
+    match_index.schedule_refresh(ids)
+    by_count = defaultdict(list)
+    for author_id, count in Counter(
+        recipe.author_id for recipe in recipes
+    ).items():
+        by_count[count].append(author_id)
+    for count, author_ids in by_count.items():
+        change_counter(User, author_ids, 'recipes_count', count)
+    feed.fan_out(ids)
+    for recipe in recipes:
+        generate_thumbnail(recipe)
+
+
+def export_records(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Все рецепты в формате импорта. Рецепты читаются по id порциями,
+    тэги и состав - одним запросом на порцию, память не зависит
+    от размера каталога.
+    """
+    last_id = 0
+    while True:
+        rows = list(Recipe.objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).values_list(
+            'id', 'name', 'text', 'cooking_time', 'image', 'author__username'
+        )[:chunk_size])
+        if not rows:
+            return
+        ids = [row[0] for row in rows]
+        tags = defaultdict(list)
+        for recipe_id, slug in RecipeTag.objects.filter(
+            recipe_id__in=ids
+        ).order_by('id').values_list('recipe_id', 'tag__slug'):
+            tags[recipe_id].append(slug)
+        contents = defaultdict(list)
+        for recipe_id, name, unit, amount in RecipeContent.objects.filter(
+            recipe_id__in=ids
+        ).order_by('id').values_list(
+            'recipe_id', 'ingredient__name',
+            'ingredient__measurement_unit__unit', 'amount'
+        ):
+            contents[recipe_id].append(
+                {'name': name, 'measurement_unit': unit, 'amount': amount}
+            )
+        for recipe_id, name, text, cooking_time, image, author in rows:
+            yield {
+                'name': name,
+                'text': text,
+                'cooking_time': cooking_time,
+                'author': author,
+                'tags': tags[recipe_id],
+                'ingredients': contents[recipe_id],
+                'image': image,
+            }
+        last_id = ids[-1]
+
+
+def export_lines(chunk_size=EXPORT_CHUNK_SIZE):
+    for record in export_records(chunk_size):
+        yield (json.dumps(record, ensure_ascii=False) + '\n').encode('utf8')
+
+
+def image_names():
+    return Recipe.objects.exclude(image='').order_by('image').values_list(
+        'image', flat=True
+    ).distinct().iterator()
+
+
+def copy_images(directory):
+    """Картинки рецептов в каталог рядом с NDJSON, под теми же именами."""
+    copied = 0
+    for name in image_names():
+        target = os.path.join(directory, name)
+        if os.path.exists(target) or not content_storage.exists(name):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with content_storage.open(name) as source, open(target, 'wb') as out:
+            shutil.copyfileobj(source, out, COPY_CHUNK_SIZE)
+        copied += 1
+    return copied
+
+
+class StreamBuffer:
+    """
+    Файл только для записи: zipfile пишет в него, а генератор сразу
+    забирает записанное. Без seek zipfile пишет размеры после данных.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def export_zip(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Zip-архив по частям: сначала картинки без сжатия, затем
+    recipes.ndjson. Архив нигде не собирается целиком.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in image_names():
+            if not content_storage.exists(name):
+                continue
+            with content_storage.open(name) as source, archive.open(
+                name, 'w'
+            ) as target:
+                for chunk in source.chunks(COPY_CHUNK_SIZE):
+                    target.write(chunk)
+                    yield from buffer.drain()
+        info = zipfile.ZipInfo(NDJSON_NAME, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, 'w', force_zip64=True) as target:
+            for line in export_lines(chunk_size):
+                target.write(line)
+                yield from buffer.drain()
+    yield from buffer.drain()
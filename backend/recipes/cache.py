@@ -0,0 +1,164 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .relations import get_cache, get_relations
+
+CATALOG_VERSION = 'recipes:version:catalog'
+LIST_VERSION = 'recipes:version:list'
+RECIPE_VERSION = 'recipes:version:recipe:{}'
+TAGS_VERSION = 'recipes:version:tags'
+INGREDIENTS_VERSION = 'recipes:version:ingredients'
+
+USER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def get_versions(*keys):
+    """
+    Текущие версии за одно обращение к кэшу. Вытесненная версия
+    заводится заново меткой времени, чтобы не вернуться к старым
+    записям с тем же номером.
+    """
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*keys):
+    """Меняет версии после фиксации транзакции."""
+    def set_versions():
+        get_cache().set_many(dict.fromkeys(keys, time.time_ns()), None)
+    transaction.on_commit(set_versions)
+
+
+def bump_recipe(recipe_id):
+    bump(LIST_VERSION, RECIPE_VERSION.format(recipe_id))
+
+
+def bump_catalog():
+    bump(CATALOG_VERSION)
+
+
+def bump_tags():
+    bump(CATALOG_VERSION, TAGS_VERSION)
+
+
+def bump_ingredients():
+    bump(CATALOG_VERSION, INGREDIENTS_VERSION)
+
+
+def strip_user_flags(recipes):
+    """Приводит выдачу к виду для анонимного пользователя."""
+    for recipe in recipes:
+        recipe['is_favorited'] = False
+        recipe['is_in_shopping_cart'] = False
+        recipe['author']['is_subscribed'] = False
+
+
+def merge_user_flags(recipes, request):
+    """
+    Проставляет флаги пользователя в закэшированную выдачу.
+    Возвращает отпечаток флагов для ETag.
+    """
+    if not request.user.is_authenticated or not recipes:
+        return ''
+    relations = get_relations(request)
+    flags = []
+    for recipe in recipes:
+        recipe['is_favorited'] = relations.is_favorited(recipe['id'])
+        recipe['is_in_shopping_cart'] = relations.is_in_shopping_cart(
+            recipe['id']
+        )
+        recipe['author']['is_subscribed'] = relations.is_subscribed(
+            recipe['author']['id']
+        )
+        flags.append((
+            recipe['is_favorited'],
+            recipe['is_in_shopping_cart'],
+            recipe['author']['is_subscribed']
+        ))
+    return repr(flags)
+
+
+def payload_recipes(data):
+    if isinstance(data, dict) and 'results' in data:
+        return data['results']
+    if isinstance(data, list):
+        return data
+    return [data]
+
+
+class RecipeCacheMixin:
+    """
+    Кэширует выдачу списка и отдельных рецептов в анонимном виде.
+    Ключ включает версии каталога, списка или рецепта, которые
+    меняются сигналами, поэтому устаревшие записи просто перестают
+    читаться. Флаги текущего пользователя накладываются поверх
+    закэшированной выдачи, ответ отдается с ETag и поддержкой 304.
+    """
+    cache_timeout = getattr(settings, 'RECIPES_CACHE_TIMEOUT', 600)
+
+    def is_cacheable(self, request):
+        return request.method == 'GET' and not any(
+            param in request.query_params for param in USER_FILTERS
+        )
+
+    def cached_response(self, request, versions, build):
+        versions = get_versions(*versions)
+        uri = request.build_absolute_uri()
+        key = 'recipes:response:' + hashlib.md5(
+            f'{versions}:{uri}'.encode('utf8')
+        ).hexdigest()
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            response = build()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            strip_user_flags(payload_recipes(data))
+            cache.set(key, data, self.cache_timeout)
+        flags = merge_user_flags(payload_recipes(data), request)
+        etag = '"{}"'.format(hashlib.md5(
+            f'{key}:{flags}'.encode('utf8')
+        ).hexdigest())
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(
+            request,
+            (CATALOG_VERSION, LIST_VERSION),
+            lambda: super(RecipeCacheMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if not self.is_cacheable(request) or not lookup.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        # /recipes/01/ - тот же рецепт 1 и та же версия, что у bump_recipe
+        return self.cached_response(
+            request,
+            (CATALOG_VERSION, RECIPE_VERSION.format(int(lookup))),
+            lambda: super(RecipeCacheMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
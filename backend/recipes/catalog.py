@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+from threading import Lock
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, get_versions
+from .models import Ingredient, Tag
+from .serializers import IngredientSerializer, TagSerializer
+
+
+class CatalogBlob:
+    """
+    Справочник целиком в виде готового JSON и его gzip-версии в памяти
+    процесса. Перед выдачей сверяется версия в общем кэше: она меняется
+    сигналами, и только тогда справочник собирается заново.
+    """
+
+    def __init__(self, version_key, queryset, serializer_class):
+        self.version_key = version_key
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self._lock = Lock()
+        self._blob = None
+
+    def build(self, version):
+        data = self.serializer_class(self.queryset.all(), many=True).data
+        content = JSONRenderer().render(data)
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        return version, etag, content, gzip.compress(content), data
+
+    def current(self):
+        version, = get_versions(self.version_key)
+        blob = self._blob
+        if blob is None or blob[0] != version:
+            with self._lock:
+                blob = self._blob
+                if blob is None or blob[0] != version:
+                    blob = self._blob = self.build(version)
+        return blob
+
+    def get(self):
+        """Возвращает (etag, json, gzip) для текущей версии."""
+        return self.current()[1:4]
+
+    def items(self):
+        """Сериализованные записи справочника для текущей версии."""
+        return self.current()[4]
+
+
+def catalog_response(request, blob):
+    """Ответ из готовых байтов, без сериализации и рендера."""
+    etag, content, compressed = blob
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(compressed, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+tags_catalog = CatalogBlob(TAGS_VERSION, Tag.objects.all(), TagSerializer)
+ingredients_catalog = CatalogBlob(
+    INGREDIENTS_VERSION,
+    Ingredient.objects.select_related('measurement_unit'),
+    IngredientSerializer
+)
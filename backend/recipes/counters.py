@@ -0,0 +1,16 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+
+def change_counter(model, ids, field, delta):
+    """
+    Атомарно меняет счетчик в базе выражением F, без чтения строк.
+    Значение не опускается ниже нуля, расхождения исправляет
+    команда reconcile_counters.
+    """
+    ids = list(ids)
+    if not ids or not delta:
+        return
+    model.objects.filter(pk__in=ids).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
@@ -0,0 +1,104 @@
+import csv
+import shutil
+from abc import ABC, abstractmethod
+from html import escape
+
+import pdfkit
+from django.db.models import Sum
+
+from .models import RecipeContent
+
+
+def shopping_list_rows(user, chunk_size=500):
+    """
+    Один GROUP BY по составу рецептов из корзины пользователя.
+    Строки читаются курсором, без загрузки всего списка в память.
+    """
+    return RecipeContent.objects.filter(
+        recipe__shopping_cart__user=user
+    ).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit__unit'
+    ).annotate(
+        total=Sum('amount')
+    ).order_by('ingredient__name').iterator(chunk_size=chunk_size)
+
+
+class ShoppingListWriter(ABC):
+    """
+    Базовый класс для выгрузки списка покупок.
+    Наследники отдают файл по частям через генератор write.
+    """
+    content_type = None
+    extension = None
+    title = 'СПИСОК ПОКУПОК'
+
+    @classmethod
+    def available(cls):
+        """Можно ли собрать файл в этом окружении."""
+        return True
+
+    @abstractmethod
+    def write(self, rows):
+        """Генератор частей файла в байтах."""
+
+
+class TextWriter(ShoppingListWriter):
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def write(self, rows):
+        yield f'{self.title}:\n'.encode('utf8')
+        for name, unit, total in rows:
+            yield f'{name}: {total}, {unit}\n'.encode('utf8')
+
+
+class Echo:
+    """Объект-заглушка для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class CsvWriter(ShoppingListWriter):
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def write(self, rows):
+        writer = csv.writer(Echo())
+        yield '\ufeff'.encode('utf8')
+        yield writer.writerow(('Ингредиент', 'Количество', 'Единица')).encode(
+            'utf8'
+        )
+        for name, unit, total in rows:
+            yield writer.writerow((name, total, unit)).encode('utf8')
+
+
+class PdfWriter(ShoppingListWriter):
+    """
+    PDF собирается через pdfkit целиком, поэтому отдается одной частью.
+    Для pdfkit нужна программа wkhtmltopdf.
+    """
+    content_type = 'application/pdf'
+    extension = 'pdf'
+
+    @classmethod
+    def available(cls):
+        return shutil.which('wkhtmltopdf') is not None
+
+    def write(self, rows):
+        lines = ''.join(
+            f'<li>{escape(name)}: {total}, {escape(unit)}</li>'
+            for name, unit, total in rows
+        )
+        html = (
+            '<html><head><meta charset="utf-8"></head><body>'
+            f'<h1>{self.title}</h1><ul>{lines}</ul></body></html>'
+        )
+        yield pdfkit.from_string(html, False)
+
+
+WRITERS = {
+    writer.extension: writer
+    for writer in (TextWriter, CsvWriter, PdfWriter)
+}
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import Max
+
+from users.models import Subscribe
+
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+
+# у авторов с большим числом подписчиков рассылка при публикации
+# заменяется подтягиванием рецептов при чтении ленты
+FANOUT_LIMIT = getattr(settings, 'FEED_FANOUT_LIMIT', 10000)
+BACKFILL_SIZE = getattr(settings, 'FEED_BACKFILL_SIZE', 50)
+
+
+def fan_out(recipe_ids):
+    """
+    Добавляет рецепты в ленты подписчиков их авторов одним
+    INSERT ... SELECT после фиксации транзакции.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+
+    def insert():
+        connection = connections[FeedEntry.objects.db]
+        quote = connection.ops.quote_name
+        subscriber = Subscribe._meta.get_field('subscriber').column
+        author = Subscribe._meta.get_field('author').column
+        recipe_author = Recipe._meta.get_field('author').column
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(FeedEntry._meta.db_table)} '
+                f'({quote("user_id")}, {quote("recipe_id")}, '
+                f'{quote("author_id")}) '
+                f'SELECT s.{quote(subscriber)}, r.{quote("id")}, '
+                f'r.{quote(recipe_author)} '
+                f'FROM {quote(Recipe._meta.db_table)} r '
+                f'JOIN {quote(Subscribe._meta.db_table)} s '
+                f'ON s.{quote(author)} = r.{quote(recipe_author)} '
+                f'JOIN {quote(User._meta.db_table)} u '
+                f'ON u.{quote("id")} = r.{quote(recipe_author)} '
+                f'WHERE r.{quote("id")} IN '
+                f'({", ".join(["%s"] * len(recipe_ids))}) '
+                f'AND u.{quote("followers_count")} <= %s '
+                'ON CONFLICT DO NOTHING',
+                [*recipe_ids, FANOUT_LIMIT]
+            )
+    transaction.on_commit(insert)
+
+
+def backfill(user_id, author_ids, newer_than=None):
+    """Последние рецепты авторов в ленту пользователя."""
+    for author_id in author_ids:
+        recipes = Recipe.objects.filter(author_id=author_id)
+        if newer_than is not None:
+            recipes = recipes.filter(id__gt=newer_than)
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                          author_id=author_id)
+                for recipe_id in recipes.order_by('-id').values_list(
+                    'id', flat=True
+                )[:BACKFILL_SIZE]
+            ],
+            ignore_conflicts=True
+        )
+
+
+def add_authors(user_id, author_ids):
+    """Подписка: в ленту попадают недавние рецепты автора."""
+    backfill(user_id, author_ids)
+
+
+def remove_authors(user_id, author_ids):
+    """Отписка: рецепты автора убираются из ленты."""
+    FeedEntry.objects.filter(
+        user_id=user_id, author_id__in=author_ids
+    ).delete()
+
+
+def pull_popular_authors(user_id):
+    """
+    Рецепты авторов, для которых рассылка отключена, подтягиваются
+    в ленту при чтении: только новее уже подтянутых.
+    """
+    author_ids = list(User.objects.filter(
+        authors__subscriber_id=user_id, followers_count__gt=FANOUT_LIMIT
+    ).values_list('id', flat=True))
+    if not author_ids:
+        return
+    newest = dict(FeedEntry.objects.filter(
+        user_id=user_id, author_id__in=author_ids
+    ).values('author_id').annotate(
+        newest=Max('recipe_id')
+    ).values_list('author_id', 'newest'))
+    for author_id in author_ids:
+        backfill(user_id, [author_id], newer_than=newest.get(author_id))
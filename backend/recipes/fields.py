@@ -1,34 +1,89 @@
 import base64
-import imghdr
+import binascii
+import re
 import uuid
 
 import six
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image
 from rest_framework import serializers
 
+DECODE_CHUNK_SIZE = 64 * 1024
+NON_ALPHABET = re.compile(r'[^A-Za-z0-9+/=]')
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
 
-class Base64ImageField(serializers.ImageField):
 
-    def get_file_extension(self, file_name, decoded_file):
+def read_header(file):
+    """Формат и размеры картинки по заголовку или None."""
+    try:
+        with Image.open(file) as image:
+            return image.format, image.width, image.height
+    except Exception:
+        return None
 
-        extension = imghdr.what(file_name, decoded_file)
-        extension = "jpg" if extension == "jpeg" else extension
 
-        return extension
+class Base64ImageField(serializers.ImageField):
+    """
+    Картинка в base64. Декодируется кусками во временный файл,
+    проверяется только заголовок: формат и размеры, без полной
+    распаковки изображения в потоке запроса.
+    """
 
-    def to_internal_value(self, data):
-        if isinstance(data, six.string_types):
-            if 'data:' in data and ';base64,' in data:
-                header, data = data.split(';base64,')
+    default_error_messages = {
+        'image_too_large': 'Изображение больше {max_pixels} пикселей.',
+    }
 
-            try:
-                decoded_file = base64.b64decode(data)
-            except TypeError:
-                self.fail('invalid_image')
+    def decode_to_file(self, data):
+        size = (len(data) // 4) * 3
+        upload = TemporaryUploadedFile(
+            str(uuid.uuid4())[:20], 'application/octet-stream', size, None
+        )
+        # символы вне алфавита (переносы строк MIME) отбрасываются, как
+        # в b64decode, а остаток не кратный 4 переносится в следующий кусок
+        pending = ''
+        try:
+            for start in range(0, len(data), DECODE_CHUNK_SIZE):
+                chunk = pending + NON_ALPHABET.sub(
+                    '', data[start:start + DECODE_CHUNK_SIZE]
+                )
+                usable = len(chunk) - len(chunk) % 4
+                upload.write(base64.b64decode(chunk[:usable]))
+                pending = chunk[usable:]
+            if pending:
+                upload.write(base64.b64decode(pending))
+        except (TypeError, ValueError, binascii.Error):
+            upload.close()
+            self.fail('invalid_image')
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
 
-            file_name = str(uuid.uuid4())[:20]
-            file_extension = self.get_file_extension(file_name, decoded_file)
-            complete_file_name = "%s.%s" % (file_name, file_extension, )
-            data = ContentFile(decoded_file, name=complete_file_name)
+    def check_header(self, upload):
+        header = read_header(upload)
+        if header is None:
+            upload.close()
+            self.fail('invalid_image')
+        image_format, width, height = header
+        extension = EXTENSIONS.get(image_format)
+        if extension is None:
+            upload.close()
+            self.fail('invalid_image')
+        max_pixels = getattr(settings, 'IMAGE_MAX_PIXELS', None)
+        if max_pixels and width * height > max_pixels:
+            upload.close()
+            self.fail('image_too_large', max_pixels=max_pixels)
+        upload.seek(0)
+        upload.name = f'{upload.name}.{extension}'
+        upload.content_type = Image.MIME[image_format]
 
-        return super().to_internal_value(data)
+    def to_internal_value(self, data):
+        if not isinstance(data, six.string_types):
+            return super().to_internal_value(data)
+        if 'data:' in data and ';base64,' in data:
+            header, data = data.split(';base64,')
+        upload = self.decode_to_file(data)
+        self.check_header(upload)
+        # полная проверка Pillow в ImageField не нужна: заголовок
+        # уже проверен, остаются проверки имени и размера FileField
+        return serializers.FileField.to_internal_value(self, upload)
@@ -1,43 +1,72 @@
-from django.db.models import Case, IntegerField, Value, When
+from django.db.models import Exists, OuterRef
 from rest_framework import filters
 
+from .catalog import tags_catalog
+from .fulltext import search_recipes
+from .models import RecipeTag
+from .relations import get_relations
+
+TRUE_VALUES = ('1', 'true', 'True')
+FALSE_VALUES = ('0', 'false', 'False')
+TAGS_MATCH_ALL = 'all'
+
 
 class CustomFilterBackend(filters.BaseFilterBackend):
 
+    @staticmethod
+    def filter_by_relation(queryset, recipe_ids, value):
+        """
+        Фильтр по избранному/корзине по множеству id из кэша связей
+        пользователя, без подзапросов к таблицам связей.
+        """
+        if value in TRUE_VALUES:
+            return queryset.filter(id__in=recipe_ids)
+        if value in FALSE_VALUES and recipe_ids:
+            return queryset.exclude(id__in=recipe_ids)
+        return queryset
+
+    @staticmethod
+    def filter_by_tags(queryset, slugs, match_all):
+        """
+        Фильтр по тэгам через EXISTS по таблице связей рецепт - тэг.
+        Slug переводятся в id по справочнику в памяти. В отличие от
+        JOIN рецепты не дублируются, поэтому DISTINCT не нужен.
+        По умолчанию подходит любой из тэгов, при tags_match=all - все.
+        """
+        ids = {tag['slug']: tag['id'] for tag in tags_catalog.items()}
+        slugs = set(slugs)
+        tag_ids = {ids[slug] for slug in slugs if slug in ids}
+        if not tag_ids or match_all and len(tag_ids) < len(slugs):
+            return queryset.none()
+        links = RecipeTag.objects.filter(recipe=OuterRef('pk'))
+        if not match_all:
+            return queryset.filter(Exists(links.filter(tag_id__in=tag_ids)))
+        for tag_id in tag_ids:
+            queryset = queryset.filter(Exists(links.filter(tag_id=tag_id)))
+        return queryset
+
     def filter_queryset(self, request, queryset, view):
         is_favorited = request.query_params.get('is_favorited')
         is_in_shopping_cart = request.query_params.get('is_in_shopping_cart')
         author_id = request.query_params.get('author')
         tags = request.query_params.getlist('tags')
+        search = request.query_params.get('search', '').strip()
+        relations = get_relations(request)
         if is_favorited:
-            queryset = queryset.filter(is_favorited=is_favorited)
+            queryset = self.filter_by_relation(
+                queryset, relations.favorites, is_favorited
+            )
         if is_in_shopping_cart:
-            queryset = queryset.filter(
-                is_in_shopping_cart=is_in_shopping_cart
+            queryset = self.filter_by_relation(
+                queryset, relations.cart, is_in_shopping_cart
             )
         if author_id:
             queryset = queryset.filter(author_id=int(author_id))
         if tags:
-            queryset = queryset.filter(tags__slug__in=tags)
-
-        return queryset.distinct()
-
-
-class CustomSearch(filters.SearchFilter):
-    search_param = 'name'
-
-    def filter_queryset(self, request, queryset, view):
-        search_fields = self.get_search_fields(view, request)
-        search_terms = request.query_params.get('name')
-
-        if not search_fields or not search_terms:
-            return queryset
-
-        return queryset.filter(
-            name__icontains=search_terms
-        ).annotate(flag=Case(
-            When(name__startswith=search_terms, then=Value(0)),
-            output_field=IntegerField(),
-            default=Value(1)
-        )
-        ).order_by('flag', 'name')
+            queryset = self.filter_by_tags(
+                queryset, tags,
+                request.query_params.get('tags_match') == TAGS_MATCH_ALL
+            )
+        if search:
+            queryset = search_recipes(queryset, search)
+        return queryset
@@ -0,0 +1,168 @@
+import re
+from collections import defaultdict
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections, transaction
+from django.db.models import (Case, F, FloatField, OuterRef, Subquery, Value,
+                              When)
+from django.db.models.functions import Coalesce
+
+from .cache import CATALOG_VERSION, LIST_VERSION, get_versions
+from .models import Recipe, RecipeContent
+
+SEARCH_CONFIG = getattr(settings, 'RECIPES_SEARCH_CONFIG', 'russian')
+SEARCH_INDEX = 'recipe_search_vector_idx'
+# веса полей как у весов A, B, C в ts_rank
+WEIGHTS = {'name': 1.0, 'text': 0.4, 'ingredients': 0.2}
+TOKEN_RE = re.compile(r'\w+')
+
+
+def is_postgresql(using=None):
+    return connections[using or Recipe.objects.db].vendor == 'postgresql'
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def ingredient_names():
+    return Coalesce(Subquery(
+        RecipeContent.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    ), Value(''))
+
+
+def update_search_vectors(recipe_ids=None):
+    """
+    Пересчитывает поисковый вектор рецептов одним UPDATE:
+    название с весом A, описание - B, названия ингредиентов - C.
+    """
+    if not is_postgresql():
+        return
+    queryset = Recipe.objects.all()
+    if recipe_ids is not None:
+        queryset = queryset.filter(pk__in=list(recipe_ids))
+    queryset.update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names(), weight='C', config=SEARCH_CONFIG)
+    ))
+
+
+def schedule_search_update(recipe_ids):
+    """Вектор считается после фиксации, когда состав рецепта записан."""
+    recipe_ids = list(recipe_ids)
+    if recipe_ids and is_postgresql():
+        transaction.on_commit(lambda: update_search_vectors(recipe_ids))
+
+
+def create_search_index(using):
+    """
+    GIN-индекс по вектору. Создается после migrate только в PostgreSQL:
+    в Meta.indexes он сломал бы создание таблиц на других СУБД.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {quote(SEARCH_INDEX)} '
+            f'ON {quote(Recipe._meta.db_table)} '
+            f'USING gin ({quote("search_vector")})'
+        )
+
+
+class RecipeIndex:
+    """
+    Инвертированный индекс рецептов в памяти процесса для СУБД без
+    полнотекстового поиска (SQLite в тестах и локально). Слово
+    отображается в {id рецепта: вес}, вес - сумма весов полей, где
+    оно встретилось. Перестраивается при смене версий списка и
+    справочников в общем кэше.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+
+    def _build(self, versions):
+        postings = defaultdict(lambda: defaultdict(float))
+        ingredients = defaultdict(list)
+        for recipe_id, name in RecipeContent.objects.values_list(
+            'recipe_id', 'ingredient__name'
+        ).iterator():
+            ingredients[recipe_id].append(name)
+        for recipe_id, name, text in Recipe.objects.values_list(
+            'id', 'name', 'text'
+        ).iterator():
+            texts = {
+                'name': name,
+                'text': text,
+                'ingredients': ' '.join(ingredients[recipe_id]),
+            }
+            for field, value in texts.items():
+                for token in set(tokenize(value)):
+                    postings[token][recipe_id] += WEIGHTS[field]
+        return versions, {
+            token: dict(recipes) for token, recipes in postings.items()
+        }
+
+    def search(self, term):
+        """Рецепты со всеми словами запроса: {id: вес}."""
+        versions = get_versions(CATALOG_VERSION, LIST_VERSION)
+        index = self._index
+        if index is None or index[0] != versions:
+            with self._lock:
+                index = self._index
+                if index is None or index[0] != versions:
+                    index = self._index = self._build(versions)
+        postings = index[1]
+        tokens = set(tokenize(term))
+        if not tokens:
+            return {}
+        matches = None
+        for token in sorted(tokens, key=lambda t: len(postings.get(t, ()))):
+            recipes = postings.get(token)
+            if not recipes:
+                return {}
+            if matches is None:
+                matches = dict(recipes)
+            else:
+                matches = {
+                    recipe_id: weight + recipes[recipe_id]
+                    for recipe_id, weight in matches.items()
+                    if recipe_id in recipes
+                }
+        return matches
+
+
+recipe_index = RecipeIndex()
+
+
+def search_recipes(queryset, term):
+    """
+    Отбирает рецепты по запросу и сортирует по релевантности.
+    В PostgreSQL - по вектору с GIN-индексом и ts_rank, на других
+    СУБД - по индексу в памяти.
+    """
+    if is_postgresql(queryset.db):
+        query = SearchQuery(term, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-id')
+    matches = recipe_index.search(term)
+    if not matches:
+        return queryset.none()
+    return queryset.filter(id__in=matches).annotate(rank=Case(
+        *[When(id=recipe_id, then=Value(weight))
+          for recipe_id, weight in matches.items()],
+        output_field=FloatField()
+    )).order_by('-rank', '-id')
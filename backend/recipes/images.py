@@ -0,0 +1,93 @@
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, transaction
+from PIL import Image
+
+from .cache import bump_recipe
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def make_thumbnail(path, size, quality):
+    """
+    Выполняется в отдельном процессе: уменьшает картинку и сохраняет
+    в WebP. Работает только с Pillow, без обращения к Django.
+    """
+    with Image.open(path) as image:
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        image.thumbnail(size)
+        result = io.BytesIO()
+        image.save(result, 'WEBP', quality=quality)
+    return result.getvalue()
+
+
+def get_executor():
+    """
+    Пул процессов для обработки картинок. При IMAGE_WORKERS = 0
+    обработка выполняется сразу в текущем процессе.
+    """
+    global _executor
+    workers = getattr(settings, 'IMAGE_WORKERS', 2)
+    if workers and _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def save_thumbnail(recipe_id, image_name, content):
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or recipe.image.name != image_name:
+        # рецепт удален или картинку успели заменить
+        return
+    name = os.path.splitext(os.path.basename(image_name))[0]
+    recipe.thumbnail.save(f'{name}.webp', ContentFile(content), save=False)
+    Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        thumbnail=recipe.thumbnail.name
+    )
+    bump_recipe(recipe_id)
+
+
+def thumbnail_done(recipe_id, image_name):
+    """Колбэк выполняется в служебном потоке пула со своим соединением."""
+    def callback(future):
+        close_old_connections()
+        try:
+            save_thumbnail(recipe_id, image_name, future.result())
+        except Exception:
+            logger.exception('Thumbnail failed for recipe %s', recipe_id)
+        finally:
+            connections.close_all()
+    return callback
+
+
+def generate_thumbnail(recipe):
+    """
+    Ставит построение миниатюры в очередь после фиксации транзакции,
+    чтобы ответ на создание рецепта не ждал обработки картинки.
+    """
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    path = recipe.image.path
+    size = getattr(settings, 'IMAGE_THUMBNAIL_SIZE', (480, 480))
+    quality = getattr(settings, 'IMAGE_THUMBNAIL_QUALITY', 80)
+
+    def submit():
+        executor = get_executor()
+        if executor is None:
+            try:
+                content = make_thumbnail(path, size, quality)
+            except Exception:
+                logger.exception('Thumbnail failed for recipe %s', recipe_id)
+                return
+            save_thumbnail(recipe_id, image_name, content)
+            return
+        future = executor.submit(make_thumbnail, path, size, quality)
+        future.add_done_callback(thumbnail_done(recipe_id, image_name))
+    transaction.on_commit(submit)
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from recipes import feed
+from recipes.models import FeedEntry
+from users.models import Subscribe
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет ленты подписчиков последними рецептами авторов '
+        'по существующим подпискам. Повторный запуск безопасен: '
+        'уже добавленные записи пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            help='Заполнить ленту только этого пользователя '
+                 '(можно указать несколько раз).'
+        )
+
+    def handle(self, *args, **options):
+        subscriptions = Subscribe.objects.order_by('subscriber_id')
+        if options['user']:
+            subscriptions = subscriptions.filter(
+                subscriber_id__in=options['user']
+            )
+        before = FeedEntry.objects.count()
+        users = 0
+        authors = []
+        current = None
+        for subscriber_id, author_id in subscriptions.values_list(
+            'subscriber_id', 'author_id'
+        ).iterator():
+            if subscriber_id != current:
+                if authors:
+                    feed.backfill(current, authors)
+                    users += 1
+                current, authors = subscriber_id, []
+            authors.append(author_id)
+        if authors:
+            feed.backfill(current, authors)
+            users += 1
+        added = FeedEntry.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено лент: {users}, добавлено записей: {added}.'
+        ))
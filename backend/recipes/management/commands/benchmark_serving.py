@@ -0,0 +1,126 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.test.client import RequestFactory
+
+from foodgram.handlers import StreamingASGIHandler
+
+DEFAULT_PATHS = (
+    '/api/v1/tags/',
+    '/api/v1/ingredients/?name=a',
+    '/api/v1/recipes/',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность и задержки обработки '
+        'запросов под WSGI и ASGI на одной и той же базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Число запросов на каждый режим.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=16,
+            help='Число одновременных запросов.'
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help='Адрес для запросов, можно указать несколько раз.'
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен пользователя для авторизованных запросов.'
+        )
+
+    def headers(self, token):
+        if not token:
+            return {}
+        return {'HTTP_AUTHORIZATION': f'Token {token}'}
+
+    def run_wsgi(self, paths, total, concurrency, headers):
+        handler = WSGIHandler()
+        factory = RequestFactory(SERVER_NAME='localhost')
+
+        def request(number):
+            environ = factory.get(paths[number % len(paths)], **headers)
+            started = time.perf_counter()
+            body = handler(environ.environ, lambda *args: None)
+            for _ in body:
+                pass
+            body.close()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(request, range(total)))
+
+    async def run_asgi(self, paths, total, concurrency, headers):
+        handler = StreamingASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+        scope_headers = [
+            (name[5:].lower().replace('_', '-').encode(), value.encode())
+            for name, value in headers.items()
+        ]
+
+        async def request(number):
+            path, _, query = paths[number % len(paths)].partition('?')
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': path,
+                'query_string': query.encode(),
+                'headers': [(b'host', b'localhost'), *scope_headers],
+                'server': ('localhost', 80),
+            }
+            messages = asyncio.Queue()
+            await messages.put({'type': 'http.request', 'body': b''})
+
+            async def send(message):
+                pass
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(scope, messages.get, send)
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(request(n) for n in range(total)))
+
+    def report(self, name, timings, elapsed):
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f'{name}: {len(timings) / elapsed:.1f} rps, '
+            f'p50 {statistics.median(timings) * 1000:.1f} мс, '
+            f'p99 {p99 * 1000:.1f} мс'
+        )
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        total = options['requests']
+        concurrency = options['concurrency']
+        headers = self.headers(options['token'])
+
+        started = time.perf_counter()
+        timings = self.run_wsgi(paths, total, concurrency, headers)
+        self.report('WSGI', timings, time.perf_counter() - started)
+
+        with override_settings(ROOT_URLCONF='foodgram.urls_async'):
+            started = time.perf_counter()
+            timings = asyncio.run(
+                self.run_asgi(paths, total, concurrency, headers)
+            )
+            self.report('ASGI', timings, time.perf_counter() - started)
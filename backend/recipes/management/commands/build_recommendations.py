@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.recommendations import rebuild_all, refresh_users, take_stale
+
+
+class Command(BaseCommand):
+    help = (
+        'Рассчитывает сходство рецептов по избранному и корзинам и '
+        'рекомендации пользователей. С --incremental пересчитывает '
+        'только пользователей, у которых были изменения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Пересчитать только пользователей из очереди по '
+                 'сохраненному сходству рецептов.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Число пользователей в одном пакете при --incremental.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if not options['incremental']:
+            recipes, users = rebuild_all()
+            self.stdout.write(self.style.SUCCESS(
+                f'Рецептов со сходством: {recipes}, пользователей: {users} '
+                f'за {time.monotonic() - started:.1f} с.'
+            ))
+            return
+        users = 0
+        while True:
+            user_ids = take_stale(options['batch_size'])
+            if not user_ids:
+                break
+            refresh_users(user_ids)
+            users += len(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено пользователей: {users} '
+            f'за {time.monotonic() - started:.1f} с.'
+        ))
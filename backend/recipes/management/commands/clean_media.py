@@ -0,0 +1,65 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.storage import content_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из медиа-хранилища картинки и миниатюры, на которые '
+        'не ссылается ни один рецепт.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=60,
+            help='Не трогать файлы моложе указанного числа минут: '
+                 'их рецепт может быть еще не сохранен.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено.'
+        )
+
+    def walk(self, directory):
+        if not content_storage.exists(directory):
+            return
+        directories, files = content_storage.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name)
+        for name in directories:
+            yield from self.walk(os.path.join(directory, name))
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for image, thumbnail in Recipe.objects.values_list(
+            'image', 'thumbnail'
+        ).iterator():
+            referenced.add(image)
+            referenced.add(thumbnail)
+        deadline = time.time() - options['grace'] * 60
+
+        removed = freed = 0
+        for name in self.walk('images'):
+            if name in referenced:
+                continue
+            path = content_storage.path(name)
+            if os.path.getmtime(path) > deadline:
+                continue
+            size = os.path.getsize(path)
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                content_storage.delete(name)
+            removed += 1
+            freed += size
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {removed}, {freed / 1024 / 1024:.1f} МБ.'
+        ))
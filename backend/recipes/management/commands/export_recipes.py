@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from recipes.bulk import (EXPORT_CHUNK_SIZE, copy_images, export_lines,
+                          export_zip)
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает все рецепты в формате import_recipes: в NDJSON '
+        '(картинки - файлами в каталог) или в zip-архив с картинками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            nargs='?',
+            default='-',
+            help='Файл .ndjson, архив .zip или - для вывода в stdout.'
+        )
+        parser.add_argument(
+            '--images',
+            help='Скопировать картинки в каталог рядом с NDJSON.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Число рецептов, читаемых из базы за раз.'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if output.endswith('.zip'):
+            chunks = export_zip(options['chunk_size'])
+        else:
+            chunks = export_lines(options['chunk_size'])
+        if output == '-':
+            self.write(sys.stdout.buffer, chunks)
+        else:
+            with open(output, 'wb') as target:
+                self.write(target, chunks)
+        if options['images'] and not output.endswith('.zip'):
+            copied = copy_images(options['images'])
+            self.stderr.write(f'Скопировано картинок: {copied}.')
+
+    @staticmethod
+    def write(target, chunks):
+        for chunk in chunks:
+            target.write(chunk)
+        target.flush()
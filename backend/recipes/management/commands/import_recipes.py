@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import zipfile
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.bulk import (BATCH_SIZE, NDJSON_NAME, DirectoryImages,
+                          RecipeImporter, ZipImages)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует рецепты из NDJSON (картинки - файлами в каталоге) '
+        'или из zip-архива с recipes.ndjson и картинками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source',
+            help='Файл .ndjson, архив .zip или - для чтения из stdin.'
+        )
+        parser.add_argument(
+            '--images',
+            help='Каталог с картинками. По умолчанию - каталог файла.'
+        )
+        parser.add_argument(
+            '--author',
+            help='Имя пользователя для рецептов без автора.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Число рецептов в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(
+                    f'Пользователь {options["author"]} не найден.'
+                )
+        importer = RecipeImporter(
+            author=author, batch_size=options['batch_size']
+        )
+        source = options['source']
+        started = time.monotonic()
+        if source.endswith('.zip'):
+            try:
+                with zipfile.ZipFile(source) as archive, archive.open(
+                    NDJSON_NAME
+                ) as lines:
+                    importer.images = ZipImages(archive)
+                    result = importer.run(lines)
+            except (OSError, zipfile.BadZipFile, KeyError) as error:
+                raise CommandError(error)
+        else:
+            images = options['images']
+            if images is None and source != '-':
+                images = os.path.dirname(os.path.abspath(source))
+            if images:
+                importer.images = DirectoryImages(images)
+            if source == '-':
+                result = importer.run(sys.stdin.buffer)
+            else:
+                with open(source, 'rb') as lines:
+                    result = importer.run(lines)
+        for error in result['errors']:
+            self.stderr.write(f'Строка {error["line"]}: {error["errors"]}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано рецептов: {result["created"]}, '
+            f'с ошибками: {len(result["errors"])} за {elapsed:.1f} с.'
+        ))
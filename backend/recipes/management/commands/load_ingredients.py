@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Ingredient, MeasureUnit
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(settings.BASE_DIR), 'data', 'ingredients.json'
+)
+
+
+def iter_json_array(path, chunk_size=64 * 1024):
+    """
+    Потоково разбирает JSON-массив верхнего уровня,
+    не загружая файл в память целиком.
+    """
+    decoder = json.JSONDecoder()
+    started = False
+    buffer = ''
+    with open(path, encoding='utf8') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            buffer += chunk
+            while True:
+                buffer = buffer.lstrip(' \t\r\n,')
+                if not buffer:
+                    break
+                if not started:
+                    if buffer[0] != '[':
+                        raise CommandError(f'{path}: ожидается JSON-массив')
+                    started = True
+                    buffer = buffer[1:]
+                    continue
+                if buffer[0] == ']':
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    break
+                yield item
+                buffer = buffer[end:]
+            if not chunk:
+                raise CommandError(f'{path}: некорректный JSON')
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты и единицы измерения из data/ingredients.json '
+        'или из фикстуры infra/fixtures.json. Повторный запуск добавляет '
+        'только новые записи.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки для bulk_create.'
+        )
+
+    def read_units(self, path):
+        """
+        Первый проход: собирает единицы измерения.
+        Для фикстуры возвращает также соответствие pk -> название.
+        """
+        units = set()
+        fixture_units = {}
+        for item in iter_json_array(path):
+            if 'model' not in item:
+                units.add(item['measurement_unit'])
+            elif item['model'] == 'recipes.measureunit':
+                units.add(item['fields']['unit'])
+                fixture_units[item['pk']] = item['fields']['unit']
+        return units, fixture_units
+
+    def read_ingredients(self, path, fixture_units):
+        """Второй проход: пары (название, единица измерения)."""
+        for item in iter_json_array(path):
+            if 'model' not in item:
+                yield item['name'], item['measurement_unit']
+            elif item['model'] == 'recipes.ingredient':
+                fields = item['fields']
+                yield fields['name'], fixture_units[fields['measurement_unit']]
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+        started = time.monotonic()
+
+        units, fixture_units = self.read_units(path)
+        MeasureUnit.objects.bulk_create(
+            [MeasureUnit(unit=unit) for unit in units],
+            ignore_conflicts=True
+        )
+        unit_ids = dict(MeasureUnit.objects.filter(
+            unit__in=units
+        ).values_list('unit', 'id'))
+        existing = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit_id'
+        ))
+
+        read = created = 0
+        batch = []
+        for name, unit in self.read_ingredients(path, fixture_units):
+            read += 1
+            key = (name, unit_ids[unit])
+            if key in existing:
+                continue
+            existing.add(key)
+            batch.append(Ingredient(name=key[0], measurement_unit_id=key[1]))
+            if len(batch) >= batch_size:
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+                created += len(batch)
+                batch = []
+        if batch:
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {read}, добавлено {created} ингредиентов, '
+            f'единиц измерения: {len(unit_ids)}. '
+            f'{read / elapsed:.0f} строк/с за {elapsed:.2f} с.'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from recipes.fulltext import is_postgresql, update_search_vectors
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет поисковые векторы рецептов, например после '
+        'первого развертывания полнотекстового поиска.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Число рецептов в одном UPDATE.'
+        )
+
+    def handle(self, *args, **options):
+        if not is_postgresql():
+            self.stdout.write(
+                'Полнотекстовый поиск в базе доступен только в PostgreSQL, '
+                'на других СУБД используется индекс в памяти.'
+            )
+            return
+        ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            update_search_vectors(ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рецептов: {len(ids)}.'
+        ))
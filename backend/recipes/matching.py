@@ -0,0 +1,137 @@
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+
+from django.db import transaction
+
+from .models import RecipeContent
+
+
+class IngredientMatchIndex:
+    """
+    Инвертированный индекс ингредиент -> отсортированный array('q')
+    с id рецептов для подбора рецептов по имеющимся продуктам.
+    Совпадения считаются Counter по массивам без обращения к базе.
+    Изменения рецептов применяются точечно по сигналам, изменения
+    из других процессов - полной пересборкой по истечении ttl секунд.
+    Массивы не меняются на месте, а заменяются новыми, поэтому
+    чтение идет без блокировки.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._index = None
+        self._built_at = 0
+
+    def _build(self):
+        postings = defaultdict(list)
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeContent.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by('recipe_id').iterator():
+            postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].add(ingredient_id)
+        self._index = (
+            {
+                ingredient_id: array('q', recipe_ids)
+                for ingredient_id, recipe_ids in postings.items()
+            },
+            {
+                recipe_id: frozenset(ingredient_ids)
+                for recipe_id, ingredient_ids in recipes.items()
+            }
+        )
+        self._built_at = time.monotonic()
+        return self._index
+
+    def _expired(self):
+        return time.monotonic() - self._built_at > self.ttl
+
+    def _ensure_built(self):
+        index = self._index
+        if index is None or self._expired():
+            with self._lock:
+                index = self._index
+                if index is None or self._expired():
+                    index = self._build()
+        return index
+
+    def refresh(self, recipe_ids):
+        """Перечитывает состав рецептов и правит только их записи."""
+        if self._index is None:
+            return
+        current = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeContent.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].add(ingredient_id)
+        with self._lock:
+            if self._index is None:
+                return
+            postings, recipes = self._index
+            for recipe_id in recipe_ids:
+                old = recipes.get(recipe_id, frozenset())
+                new = frozenset(current.get(recipe_id, ()))
+                for ingredient_id in old - new:
+                    self._remove(postings, ingredient_id, recipe_id)
+                for ingredient_id in new - old:
+                    self._add(postings, ingredient_id, recipe_id)
+                if new:
+                    recipes[recipe_id] = new
+                else:
+                    recipes.pop(recipe_id, None)
+
+    @staticmethod
+    def _add(postings, ingredient_id, recipe_id):
+        recipe_ids = postings.get(ingredient_id, array('q'))
+        position = bisect_left(recipe_ids, recipe_id)
+        postings[ingredient_id] = (
+            recipe_ids[:position] + array('q', [recipe_id])
+            + recipe_ids[position:]
+        )
+
+    @staticmethod
+    def _remove(postings, ingredient_id, recipe_id):
+        recipe_ids = postings.get(ingredient_id)
+        if recipe_ids is None:
+            return
+        position = bisect_left(recipe_ids, recipe_id)
+        if position < len(recipe_ids) and recipe_ids[position] == recipe_id:
+            recipe_ids = recipe_ids[:position] + recipe_ids[position + 1:]
+            if recipe_ids:
+                postings[ingredient_id] = recipe_ids
+            else:
+                del postings[ingredient_id]
+
+    def invalidate(self):
+        """Следующий подбор соберет индекс заново."""
+        with self._lock:
+            self._index = None
+
+    def schedule_refresh(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        transaction.on_commit(lambda: self.refresh(recipe_ids))
+
+    def match(self, ingredient_ids, max_missing=None):
+        """
+        Рецепты, где есть хотя бы один из ингредиентов, в виде
+        (id, совпало, не хватает): сначала те, где не хватает меньше,
+        затем с большим числом совпадений, затем новые.
+        """
+        postings, recipes = self._ensure_built()
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        result = []
+        for recipe_id, count in matched.items():
+            missing = len(recipes.get(recipe_id, ())) - count
+            if max_missing is None or missing <= max_missing:
+                result.append((recipe_id, count, missing))
+        result.sort(key=lambda item: (item[2], -item[1], -item[0]))
+        return result
+
+
+match_index = IngredientMatchIndex()
@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
+from users.models import DatabaseFieldsMixin
+from .storage import content_storage
+
 User = get_user_model()
 
 
@@ -69,16 +73,28 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(DatabaseFieldsMixin, models.Model):
     """
     Класс для рецептов
     """
     tags = models.ManyToManyField(
         Tag,
+        through='RecipeTag',
         verbose_name='Тэги',
         related_name='recipes'
     )
-    image = models.ImageField(verbose_name='Картинка', upload_to='images/')
+    image = models.ImageField(
+        verbose_name='Картинка',
+        upload_to='images/',
+        storage=content_storage
+    )
+    thumbnail = models.ImageField(
+        verbose_name='Миниатюра',
+        upload_to='images/thumbnails/',
+        storage=content_storage,
+        blank=True,
+        editable=False
+    )
     ingredients = models.ManyToManyField(
         Ingredient,
         through='RecipeContent',
@@ -99,6 +115,19 @@ class Recipe(models.Model):
         related_name='recipes',
         verbose_name='Автор рецепта'
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    database_fields = ('favorites_count', 'in_carts_count', 'search_vector')
 
     def __str__(self):
         return self.name
@@ -106,6 +135,48 @@ class Recipe(models.Model):
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popularity_idx'
+            ),
+        ]
+
+
+class RecipeTag(models.Model):
+    """
+    Связь рецепта с тэгом. Таблица та же, что у автоматической
+    промежуточной модели, добавлен индекс для поиска рецептов по тэгу.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='recipe_tags',
+        verbose_name='Рецепт'
+    )
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='recipe_tags',
+        verbose_name='Тэг'
+    )
+
+    class Meta:
+        db_table = 'recipes_recipe_tags'
+        verbose_name = 'Тэг рецепта'
+        verbose_name_plural = 'Тэги рецепта'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'tag'],
+                name='unique tag per recipe'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['tag', 'recipe'],
+                name='recipe_tag_tag_recipe_idx'
+            ),
+        ]
 
 
 class RecipeContent(models.Model):
@@ -194,3 +265,129 @@ class ShoppingCart(models.Model):
                 name='unique user per recipe in shopping cart'
             ),
         ]
+
+
+class RecipeSimilarity(models.Model):
+    """
+    Похожие рецепты по совместному добавлению в избранное и корзины.
+    Для каждого рецепта хранится ограниченное число соседей.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique similar recipe'
+            ),
+        ]
+
+
+class Recommendation(models.Model):
+    """
+    Рекомендованные пользователю рецепты (top-K), готовые к выдаче.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(verbose_name='Оценка')
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique recommended recipe per user'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-score'],
+                name='recommendation_user_score_idx'
+            ),
+        ]
+
+
+class StaleRecommendation(models.Model):
+    """
+    Пользователи, у которых изменились избранное или корзина после
+    последнего расчета рекомендаций.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name='Пользователь'
+    )
+
+    class Meta:
+        verbose_name = 'Устаревшие рекомендации'
+        verbose_name_plural = 'Устаревшие рекомендации'
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты подписок: рецепт автора, на которого подписан
+    пользователь. Заполняется при публикации рецепта.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        # индекс ограничения (user, recipe) дает выборку ленты
+        # одним диапазоном в обратном порядке
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique recipe per feed'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx'
+            ),
+        ]
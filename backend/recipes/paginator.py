@@ -1,5 +1,153 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagePaginator(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+def estimate_count(queryset):
+    """
+    Оценка числа строк по плану запроса PostgreSQL без COUNT(*).
+    На других СУБД возвращает точное значение.
+    """
+    if queryset.query.is_empty():
+        return 0
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    # explain() в Django 3.2 возвращает repr плана, а не JSON,
+    # поэтому EXPLAIN выполняется напрямую: psycopg2 сам разбирает json
+    try:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        # например, id__in с пустым множеством: строк заведомо нет
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagePaginator(CustomPagePaginator):
+    """
+    Постраничная выдача по ключу (-id) вместо OFFSET.
+    Включается параметром cursor (для первой страницы - пустым),
+    без него работает обычная нумерация страниц. Ответ имеет тот же
+    формат: count, next, previous, results. При count=approx
+    количество берется из оценки планировщика.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+    key_field = 'id'
+
+    keyset = False
+
+    def is_keyset(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def encode_cursor(self, reverse, position):
+        token = urlsafe_b64encode(
+            f'{int(reverse)}:{position}'.encode('ascii')
+        )
+        return replace_query_param(
+            remove_query_param(
+                self.request.build_absolute_uri(), self.page_query_param
+            ),
+            self.cursor_query_param,
+            token.decode('ascii')
+        )
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return False, None
+        try:
+            reverse, position = urlsafe_b64decode(
+                token.encode('ascii')
+            ).decode('ascii').split(':')
+            return bool(int(reverse)), int(position)
+        except (binascii.Error, UnicodeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_count(self, queryset, request):
+        if request.query_params.get(self.count_query_param) == 'approx':
+            return estimate_count(queryset)
+        return queryset.count()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset(request)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        reverse, position = self.decode_cursor(request)
+        self.count = self.get_count(queryset, request)
+
+        key = self.key_field
+        if reverse:
+            queryset = queryset.filter(
+                **{f'{key}__gt': position}
+            ).order_by(key)
+        else:
+            queryset = queryset.order_by(f'-{key}')
+            if position is not None:
+                queryset = queryset.filter(**{f'{key}__lt': position})
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_link = None
+        self.previous_link = None
+        if page and has_next:
+            self.next_link = self.encode_cursor(
+                False, getattr(page[-1], key)
+            )
+        if page and has_previous:
+            self.previous_link = self.encode_cursor(
+                True, getattr(page[0], key)
+            )
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.next_link),
+            ('previous', self.previous_link),
+            ('results', data)
+        ]))
+
+
+class FeedPaginator(KeysetPagePaginator):
+    """
+    Лента подписок всегда выдается по ключу - id рецепта в таблице
+    ленты, без OFFSET. Точное число записей не считается: count
+    равен null, при count=approx - оценке планировщика.
+    """
+    key_field = 'recipe_id'
+
+    def is_keyset(self, request):
+        return True
+
+    def get_count(self, queryset, request):
+        if request.query_params.get(self.count_query_param) == 'approx':
+            return estimate_count(queryset)
+        return None
@@ -0,0 +1,101 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework import serializers
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def _serializer_plan(serializer, model):
+    """
+    Обходит дерево полей сериализатора и собирает план загрузки:
+    пути для select_related и вложенные планы для prefetch_related.
+    """
+    selects = set()
+    prefetches = {}
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        nested = field
+        if isinstance(field, serializers.ListSerializer):
+            nested = field.child
+        current = model
+        path = []
+        for attr in field.source.split('.'):
+            model_field = _model_field(current, attr)
+            if model_field is None or not model_field.is_relation:
+                break
+            path.append(attr)
+            current = model_field.related_model
+            if model_field.many_to_many or model_field.one_to_many:
+                if len(path) > 1:
+                    selects.add('__'.join(path[:-1]))
+                sub_plan = ((), ())
+                if isinstance(nested, serializers.Serializer):
+                    sub_plan = _serializer_plan(nested, current)
+                prefetches['__'.join(path)] = (current, sub_plan)
+                path = []
+                break
+        else:
+            if path and isinstance(nested, serializers.Serializer):
+                prefix = '__'.join(path)
+                sub_selects, sub_prefetches = _serializer_plan(
+                    nested, current
+                )
+                selects.update(f'{prefix}__{item}' for item in sub_selects)
+                for lookup, sub_plan in sub_prefetches:
+                    prefetches[f'{prefix}__{lookup}'] = sub_plan
+        if path:
+            selects.add('__'.join(path))
+    return tuple(sorted(selects)), tuple(prefetches.items())
+
+
+@lru_cache(maxsize=None)
+def get_plan(serializer_class, model):
+    """План строится один раз на пару сериализатор-модель."""
+    return _serializer_plan(serializer_class(), model)
+
+
+def _prefetches(prefetches):
+    return [
+        Prefetch(
+            lookup,
+            queryset=_apply_plan(model._default_manager.all(), sub_plan)
+        )
+        for lookup, (model, sub_plan) in prefetches
+    ]
+
+
+def _apply_plan(queryset, plan):
+    selects, prefetches = plan
+    if selects:
+        queryset = queryset.select_related(*selects)
+    if prefetches:
+        queryset = queryset.prefetch_related(*_prefetches(prefetches))
+    return queryset
+
+
+def plan_queryset(queryset, serializer_class):
+    """
+    Добавляет к queryset select_related/prefetch_related по дереву полей
+    сериализатора, чтобы страница любого размера стоила постоянное
+    число запросов.
+    """
+    return _apply_plan(queryset, get_plan(serializer_class, queryset.model))
+
+
+def prefetch_instances(instances, serializer_class):
+    """
+    Подгружает связи по тому же плану для уже полученных объектов,
+    например, для рецепта сразу после создания или изменения.
+    """
+    if not instances:
+        return
+    _, prefetches = get_plan(serializer_class, type(instances[0]))
+    prefetch_related_objects(instances, *_prefetches(prefetches))
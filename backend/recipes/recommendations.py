@@ -0,0 +1,190 @@
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import (Favorite, RecipeSimilarity, Recommendation, ShoppingCart,
+                     StaleRecommendation)
+
+RECOMMENDATIONS_SIZE = getattr(settings, 'RECOMMENDATIONS_SIZE', 20)
+NEIGHBORS_SIZE = getattr(settings, 'RECOMMENDATIONS_NEIGHBORS', 50)
+# у слишком активных пользователей квадратичное число пар и мало сигнала
+MAX_USER_ITEMS = 500
+# вес действия в матрице пользователь - рецепт
+WEIGHTS = ((Favorite, 1.0), (ShoppingCart, 0.5))
+
+
+def load_interactions(user_ids=None):
+    """Разреженная матрица пользователь - рецепт: {user: {recipe: вес}}."""
+    rows = defaultdict(dict)
+    for model, weight in WEIGHTS:
+        queryset = model.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=user_ids)
+        for user_id, recipe_id in queryset.values_list(
+            'user_id', 'recipe_id'
+        ).iterator():
+            items = rows[user_id]
+            items[recipe_id] = max(items.get(recipe_id, 0.0), weight)
+    return rows
+
+
+def item_similarities(interactions, size=NEIGHBORS_SIZE):
+    """
+    Косинусное сходство столбцов матрицы. Произведение X^T X
+    накапливается только по ненулевым элементам строк, затем каждое
+    значение делится на нормы столбцов. Для рецепта остается size
+    самых похожих.
+    """
+    norms = defaultdict(float)
+    products = defaultdict(lambda: defaultdict(float))
+    for items in interactions.values():
+        if len(items) > MAX_USER_ITEMS:
+            continue
+        pairs = list(items.items())
+        for position, (recipe_id, weight) in enumerate(pairs):
+            norms[recipe_id] += weight * weight
+            for other_id, other_weight in pairs[position + 1:]:
+                product = weight * other_weight
+                products[recipe_id][other_id] += product
+                products[other_id][recipe_id] += product
+    similar = {}
+    for recipe_id, row in products.items():
+        norm = norms[recipe_id]
+        similar[recipe_id] = heapq.nlargest(
+            size,
+            (
+                (other_id, value / math.sqrt(norm * norms[other_id]))
+                for other_id, value in row.items()
+            ),
+            key=lambda item: item[1]
+        )
+    return similar
+
+
+def recommend(items, similar, size=RECOMMENDATIONS_SIZE):
+    """
+    Оценка рецепта - сумма его сходства с рецептами пользователя,
+    умноженного на вес действия. Уже отмеченные рецепты пропускаются.
+    """
+    scores = defaultdict(float)
+    for recipe_id, weight in items.items():
+        for other_id, score in similar.get(recipe_id, ()):
+            if other_id not in items:
+                scores[other_id] += weight * score
+    return heapq.nlargest(size, scores.items(), key=lambda item: item[1])
+
+
+def load_similarities(recipe_ids):
+    similar = defaultdict(list)
+    for recipe_id, other_id, score in RecipeSimilarity.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'similar_id', 'score').iterator():
+        similar[recipe_id].append((other_id, score))
+    return similar
+
+
+def store_similarities(similar):
+    with transaction.atomic():
+        RecipeSimilarity.objects.all().delete()
+        RecipeSimilarity.objects.bulk_create(
+            (
+                RecipeSimilarity(
+                    recipe_id=recipe_id, similar_id=other_id, score=score
+                )
+                for recipe_id, row in similar.items()
+                for other_id, score in row
+            ),
+            batch_size=5000
+        )
+
+
+def store_recommendations(recommendations, user_ids=None):
+    """
+    Заменяет рекомендации пользователей user_ids (при None - всех)
+    в одной транзакции.
+    """
+    with transaction.atomic():
+        queryset = Recommendation.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=user_ids)
+        queryset.delete()
+        Recommendation.objects.bulk_create(
+            (
+                Recommendation(user_id=user_id, recipe_id=recipe_id,
+                               score=score)
+                for user_id, rows in recommendations.items()
+                for recipe_id, score in rows
+            ),
+            batch_size=5000
+        )
+
+
+def rebuild_all():
+    """
+    Полный пересчет: сходство рецептов и рекомендации всех. Очередь
+    очищается до чтения данных: все, что в ней было, войдет в расчет.
+    """
+    StaleRecommendation.objects.all().delete()
+    interactions = load_interactions()
+    similar = item_similarities(interactions)
+    store_similarities(similar)
+    store_recommendations({
+        user_id: recommend(items, similar)
+        for user_id, items in interactions.items()
+    })
+    return len(similar), len(interactions)
+
+
+def refresh_users(user_ids):
+    """Пересчет рекомендаций пользователей по сохраненному сходству."""
+    interactions = load_interactions(user_ids)
+    similar = load_similarities({
+        recipe_id
+        for items in interactions.values()
+        for recipe_id in items
+    })
+    store_recommendations(
+        {
+            user_id: recommend(interactions.get(user_id, {}), similar)
+            for user_id in user_ids
+        },
+        user_ids
+    )
+
+
+def take_stale(limit):
+    """
+    Забирает пользователей из очереди. Строки удаляются до расчета,
+    поэтому изменения во время расчета снова попадут в очередь.
+    """
+    user_ids = list(StaleRecommendation.objects.values_list(
+        'user_id', flat=True
+    )[:limit])
+    StaleRecommendation.objects.filter(user_id__in=user_ids).delete()
+    return user_ids
+
+
+def mark_stale(user_id):
+    """
+    Ставит пользователя в очередь пересчета после фиксации транзакции.
+    INSERT ... SELECT ничего не вставит, если пользователь уже удален.
+    """
+    def insert():
+        connection = connections[StaleRecommendation.objects.db]
+        quote = connection.ops.quote_name
+        field = StaleRecommendation._meta.get_field('user')
+        users = field.related_model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(StaleRecommendation._meta.db_table)} '
+                f'({quote(field.column)}) '
+                f'SELECT {quote(users.pk.column)} '
+                f'FROM {quote(users.db_table)} '
+                f'WHERE {quote(users.pk.column)} = %s '
+                'ON CONFLICT DO NOTHING',
+                [user_id]
+            )
+    transaction.on_commit(insert)
@@ -0,0 +1,112 @@
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import CharField, F, Value
+
+from users.models import Subscribe
+
+from .models import Favorite, ShoppingCart
+
+RELATIONS_KEY = 'relations:user:{}:{}'
+RELATIONS_VERSION = 'relations:version:user:{}'
+RELATIONS_TIMEOUT = getattr(settings, 'RELATIONS_CACHE_TIMEOUT', 300)
+KINDS = ('favorites', 'cart', 'subscriptions')
+
+
+class UserRelations:
+    """
+    Избранное, корзина и подписки пользователя в виде множеств id.
+    В кэше хранятся отсортированными массивами array('q').
+    """
+    __slots__ = KINDS
+
+    def __init__(self, favorites=(), cart=(), subscriptions=()):
+        self.favorites = frozenset(favorites)
+        self.cart = frozenset(cart)
+        self.subscriptions = frozenset(subscriptions)
+
+    def is_favorited(self, recipe_id):
+        return recipe_id in self.favorites
+
+    def is_in_shopping_cart(self, recipe_id):
+        return recipe_id in self.cart
+
+    def is_subscribed(self, author_id):
+        return author_id in self.subscriptions
+
+
+ANONYMOUS = UserRelations()
+
+
+def get_cache():
+    return caches[getattr(settings, 'RECIPES_CACHE', 'default')]
+
+
+def load_relations(user_id):
+    """Все три множества одним запросом."""
+    rows = Favorite.objects.filter(user_id=user_id).annotate(
+        kind=Value('favorites', output_field=CharField()),
+        target=F('recipe_id')
+    ).values_list('kind', 'target').union(
+        ShoppingCart.objects.filter(user_id=user_id).annotate(
+            kind=Value('cart', output_field=CharField()),
+            target=F('recipe_id')
+        ).values_list('kind', 'target'),
+        Subscribe.objects.filter(subscriber_id=user_id).annotate(
+            kind=Value('subscriptions', output_field=CharField()),
+            target=F('author_id')
+        ).values_list('kind', 'target'),
+        all=True
+    )
+    ids = {kind: [] for kind in KINDS}
+    for kind, target in rows:
+        ids[kind].append(target)
+    return tuple(array('q', sorted(ids[kind])) for kind in KINDS)
+
+
+def relations_version(cache, user_id):
+    """
+    Версия связей пользователя. Вытесненная версия заводится заново
+    меткой времени, как в cache.get_versions.
+    """
+    key = RELATIONS_VERSION.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_relations(request):
+    """
+    Связи текущего пользователя. Читаются из кэша один раз за запрос,
+    при промахе загружаются из базы. Ключ содержит версию, прочитанную
+    до загрузки: если связи изменятся во время чтения из базы, устаревшие
+    множества окажутся под уже сброшенной версией.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return ANONYMOUS
+    relations = getattr(request, '_relations', None)
+    if relations is None:
+        cache = get_cache()
+        key = RELATIONS_KEY.format(
+            user.pk, relations_version(cache, user.pk)
+        )
+        arrays = cache.get(key)
+        if arrays is None:
+            arrays = load_relations(user.pk)
+            cache.add(key, arrays, RELATIONS_TIMEOUT)
+        relations = UserRelations(*arrays)
+        request._relations = relations
+    return relations
+
+
+def invalidate_relations(user_id):
+    """Меняет версию связей пользователя после фиксации транзакции."""
+    transaction.on_commit(lambda: get_cache().set(
+        RELATIONS_VERSION.format(user_id), time.time_ns(), None
+    ))
@@ -1,4 +1,4 @@
-from rest_framework.renderers import BaseRenderer
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 
 
 class BinaryFileRenderer(BaseRenderer):
@@ -8,4 +8,7 @@ class BinaryFileRenderer(BaseRenderer):
     render_style = 'binary'
 
     def render(self, data, media_type=None, renderer_context=None):
-        return data
+        if isinstance(data, (bytes, bytearray)):
+            return data
+        # ошибки отдаются в том же виде, что и в остальном API
+        return JSONRenderer().render(data, media_type, renderer_context)
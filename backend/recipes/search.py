@@ -0,0 +1,69 @@
+from bisect import bisect_left
+from threading import Lock
+
+from .cache import INGREDIENTS_VERSION, get_versions
+from .catalog import ingredients_catalog
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+    Хранит отсортированный по имени массив готовых к выдаче записей:
+    совпадения по началу строки ищутся бинарным поиском, совпадения
+    по подстроке - одним проходом по массиву. Собирается из справочника
+    ингредиентов и перестраивается при смене его версии в общем кэше,
+    поэтому изменения из других процессов видны сразу.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+
+    @staticmethod
+    def _build(version):
+        items = sorted(
+            (
+                (ingredient['name'].lower(), dict(ingredient))
+                for ingredient in ingredients_catalog.items()
+            ),
+            key=lambda item: (item[0], item[1]['measurement_unit'])
+        )
+        return (
+            version,
+            [key for key, _ in items],
+            [item for _, item in items]
+        )
+
+    def _ensure_built(self):
+        version, = get_versions(INGREDIENTS_VERSION)
+        index = self._index
+        if index is None or index[0] != version:
+            with self._lock:
+                index = self._index
+                if index is None or index[0] != version:
+                    index = self._index = self._build(version)
+        return index[1:]
+
+    def search(self, term, limit=None):
+        """
+        Сначала совпадения по началу названия, затем по подстроке,
+        внутри каждой группы - по алфавиту.
+        """
+        keys, items = self._ensure_built()
+        term = term.lower()
+        result = []
+        position = bisect_left(keys, term)
+        while position < len(keys) and keys[position].startswith(term):
+            result.append(items[position])
+            position += 1
+            if limit and len(result) >= limit:
+                return result
+        for key, item in zip(keys, items):
+            if term in key and not key.startswith(term):
+                result.append(item)
+                if limit and len(result) >= limit:
+                    break
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -1,10 +1,16 @@
-from django.shortcuts import get_object_or_404
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import CharField, Value
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError, ParseError
+from rest_framework.exceptions import ValidationError
 
 from users.serializers import UserSerializer
 from .fields import Base64ImageField
+from .images import generate_thumbnail
 from .models import Ingredient, Recipe, RecipeContent, Tag
+from .planner import prefetch_instances
+from .relations import get_relations
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -38,37 +44,21 @@ class RecipeContentSerializer(serializers.ModelSerializer):
     measurement_unit = serializers.CharField(
         read_only=True, source='ingredient.measurement_unit'
     )
+    # в модели у количества есть default, но в запросе оно обязательно
+    amount = serializers.IntegerField()
 
     class Meta:
         fields = ('id', 'name', 'measurement_unit', 'amount', )
         model = RecipeContent
 
-    def validate(self, attrs):
-        if self.context.get('request').method in ('POST', 'PUT', 'PATCH'):
-            if attrs['amount'] < 1:
-                ingredient = get_object_or_404(
-                    Ingredient, id=attrs['ingredient']['id'])
-                error_data = {'amount': ['Количество для ингредиента '
-                                         f'{ingredient.name} должно быть больше 0.']}
-                raise ParseError(error_data)
-        return attrs
-
 
 class RecipeSerializer(serializers.ModelSerializer):
 
     tags = TagSerializer(many=True)
     author = UserSerializer(many=False, read_only=True)
     ingredients = RecipeContentSerializer(source='recipe_content', many=True)
-    is_favorited = serializers.BooleanField(
-        default=False,
-        required=False,
-        read_only=True
-    )
-    is_in_shopping_cart = serializers.BooleanField(
-        default=False,
-        required=False,
-        read_only=True
-    )
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField(use_url=True, max_length=None)
 
     class Meta:
@@ -86,81 +76,170 @@ class RecipeSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    def get_is_favorited(self, obj):
+        return get_relations(self.context['request']).is_favorited(obj.pk)
+
+    def get_is_in_shopping_cart(self, obj):
+        return get_relations(
+            self.context['request']
+        ).is_in_shopping_cart(obj.pk)
+
+    @staticmethod
+    def lookup_names(ingredient_ids, tag_ids):
+        """
+        Одним запросом получает названия переданных ингредиентов
+        и проверяет существование тэгов.
+        """
+        ingredients = Ingredient.objects.filter(
+            id__in=ingredient_ids
+        ).annotate(
+            kind=Value('ingredient', output_field=CharField())
+        ).values_list('kind', 'id', 'name')
+        tags = Tag.objects.filter(id__in=tag_ids).annotate(
+            kind=Value('tag', output_field=CharField())
+        ).values_list('kind', 'id', 'name')
+        names = {'ingredient': {}, 'tag': {}}
+        for kind, pk, name in ingredients.union(tags, all=True):
+            names[kind][pk] = name
+        return names['ingredient'], names['tag']
+
     def validate(self, attrs):
-        if self.context.get('request').method in ('POST', 'PUT', 'PATCH'):
-            if attrs['cooking_time'] < 1:
-                raise serializers.ValidationError(
-                    'Время приготовления должно быть больше 0'
+        """
+        Проверяет рецепт за один проход по составу и собирает все ошибки
+        сразу. Названия ингредиентов для сообщений и существование
+        ингредиентов и тэгов проверяются одним запросом.
+        """
+        errors = defaultdict(list)
+        if attrs.get('cooking_time', 1) < 1:
+            errors['cooking_time'].append(
+                'Время приготовления должно быть больше 0'
+            )
+        tag_ids = set(attrs.get('tags') or ())
+        if not tag_ids and (not self.partial or 'tags' in attrs):
+            errors['tags'].append('Укажите тэги, пожалуйста.')
+        contents = attrs.get('recipe_content') or ()
+        if not contents and (not self.partial or 'recipe_content' in attrs):
+            errors['ingredients'].append('Добавьте хотя бы 1 ингредиент')
+
+        amounts = {}
+        duplicates = []
+        non_positive = []
+        for item in contents:
+            ingredient_id = item['ingredient']['id']
+            if ingredient_id in amounts and ingredient_id not in duplicates:
+                duplicates.append(ingredient_id)
+            amounts[ingredient_id] = item['amount']
+            if item['amount'] < 1:
+                non_positive.append(ingredient_id)
+
+        if amounts or tag_ids:
+            names, known_tags = self.lookup_names(amounts, tag_ids)
+            unknown = [pk for pk in amounts if pk not in names]
+            if unknown:
+                errors['ingredients'].append(
+                    'Ингредиенты не найдены: '
+                    f'{", ".join(map(str, unknown))}.'
                 )
-            if not attrs['tags']:
-                raise serializers.ValidationError(
-                    'Укажите тэги, пожалуйста.'
+            unknown_tags = sorted(tag_ids - set(known_tags))
+            if unknown_tags:
+                errors['tags'].append(
+                    f'Тэги не найдены: {", ".join(map(str, unknown_tags))}.'
                 )
-            if not attrs.get('recipe_content'):
-                raise serializers.ValidationError(
-                    'Добавьте хотя бы 1 ингредиент'
+            for pk in duplicates:
+                errors['ingredients'].append(
+                    f'Ингредиенты {names.get(pk, pk)} повторяются, '
+                    'пожалуйста, укажите уникальные.'
                 )
-            ing_list = []
-            for ingredients in attrs.get('recipe_content'):
-                ing_list.append(ingredients['ingredient']['id'])
-
-            for ing in ing_list:
-                if ing_list.count(ing)>1:
-                    ingredient = get_object_or_404(Ingredient, id=ing)
-                    error_data = {'ingredients': [
-                        f'Ингредиенты {ingredient.name} повторяются, '
-                        'пожалуйста, укажите уникальные.'
-                    ]
-                    }
-                    raise ParseError(error_data)
-
-            # if len(list(ing_list)) > len(set(ing_list)):
-            #     raise serializers.ValidationError(
-            #         'Ингредиенты повторяются, пожалуйста, укажите уникальные.'
-            #     )
-            for ing in attrs.get('recipe_content'):
-                if int(ing['amount']) < 1:
-                    ingredient = get_object_or_404(
-                        Ingredient, id=attrs['ingredient']['id'])
-                    error_data = {'amount': ['Количество для ингредиента '
-                                  f'{ingredient.name} должно быть больше 0.']}
-                    raise ParseError(error_data)
+            for pk in non_positive:
+                errors['amount'].append(
+                    'Количество для ингредиента '
+                    f'{names.get(pk, pk)} должно быть больше 0.'
+                )
+        if errors:
+            raise serializers.ValidationError(errors)
         return attrs
 
-    def create_or_update(self, validated_data, instance=None):
-        args = locals()
-        contents = validated_data.pop('recipe_content')
-        tags = validated_data.pop('tags')
-        if instance:
-            instance = args['instance']
-            instance.name = validated_data.get('name', instance.name)
-            instance.text = validated_data.get('text', instance.text)
-            instance.cooking_time = validated_data.get(
-                'cooking_time', instance.cooking_time
-            )
-            instance.image = validated_data.get('image', instance.image)
-        else:
-            author = self.context.get('request').user
-            instance = Recipe.objects.create(**validated_data, author=author)
-        instance.tags.set(tags)
-        instance.save()
-        instance.ingredients.clear()
-        for item in contents:
-            content = RecipeContentSerializer(item).data
-            amount = content['amount']
-            ingredient_id = content['id']
-            ingredient = get_object_or_404(Ingredient, pk=ingredient_id)
-            content = RecipeContent.objects.create(
+    @staticmethod
+    def write_contents(instance, contents, created):
+        """
+        Сверяет переданный состав с сохраненным и записывает разницу
+        пачками: bulk_create для новых, bulk_update для изменившихся,
+        одно удаление для убранных ингредиентов.
+        """
+        amounts = {
+            item['ingredient']['id']: item['amount'] for item in contents
+        }
+        existing = {}
+        if not created:
+            existing = {
+                content.ingredient_id: content
+                for content in instance.recipe_content.all()
+            }
+        to_update = []
+        for ingredient_id, content in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and content.amount != amount:
+                content.amount = amount
+                to_update.append(content)
+        RecipeContent.objects.bulk_create([
+            RecipeContent(
                 recipe=instance,
-                ingredient=ingredient,
+                ingredient_id=ingredient_id,
                 amount=amount
             )
-            content.save()
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ])
+        if to_update:
+            RecipeContent.objects.bulk_update(to_update, ['amount'])
+        removed = set(existing) - set(amounts)
+        if removed:
+            instance.recipe_content.filter(
+                ingredient_id__in=removed
+            ).delete()
+
+    @transaction.atomic
+    def create_or_update(self, validated_data, instance=None):
+        contents = validated_data.pop('recipe_content', None)
+        tags = validated_data.pop('tags', None)
+        created = instance is None
+        if created:
+            author = self.context.get('request').user
+            instance = Recipe.objects.create(**validated_data, author=author)
+        else:
+            for field in ('name', 'text', 'cooking_time', 'image'):
+                if field in validated_data:
+                    setattr(instance, field, validated_data[field])
+            if 'image' in validated_data:
+                instance.thumbnail = ''
+            instance.save()
+        if 'image' in validated_data:
+            # временный файл уже перенесен в хранилище
+            validated_data['image'].close()
+            generate_thumbnail(instance)
+        if tags is not None:
+            instance.tags.set(tags)
+        if contents is not None:
+            self.write_contents(instance, contents, created)
         return instance
 
     def create(self, validated_data):
         return self.create_or_update(validated_data)
 
+    def to_representation(self, instance):
+        if not getattr(instance, '_prefetched_objects_cache', None):
+            prefetch_instances([instance], type(self))
+        data = super().to_representation(instance)
+        if instance.thumbnail and isinstance(
+            self.parent, serializers.ListSerializer
+        ):
+            # в списках (выдача, лента, подбор, рекомендации) отдается
+            # миниатюра, оригинал - на странице рецепта
+            data['image'] = self.fields['image'].to_representation(
+                instance.thumbnail
+            )
+        return data
+
     def update(self, instance, validated_data):
         return self.create_or_update(
             instance=instance,
@@ -0,0 +1,154 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save)
+from django.dispatch import receiver
+
+from users.models import Subscribe
+
+from . import feed
+from .cache import bump_catalog, bump_ingredients, bump_recipe, bump_tags
+from .counters import change_counter
+from .fulltext import create_search_index, schedule_search_update
+from .matching import match_index
+from .models import (Favorite, Ingredient, MeasureUnit, Recipe, RecipeContent,
+                     ShoppingCart, Tag)
+from .recommendations import mark_stale
+from .relations import invalidate_relations
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def reset_recipe_cache(instance, **kwargs):
+    bump_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(instance, **kwargs):
+    schedule_search_update([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_recipe_match_index(instance, **kwargs):
+    # состав из bulk_create сериализатора виден после фиксации
+    match_index.schedule_refresh([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=RecipeContent)
+def update_recipe_content_match_index(instance, **kwargs):
+    match_index.schedule_refresh([instance.recipe_id])
+
+
+@receiver([post_save, post_delete], sender=RecipeContent)
+def update_recipe_content_search(instance, **kwargs):
+    schedule_search_update([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search(instance, created, **kwargs):
+    if not created:
+        schedule_search_update(RecipeContent.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True))
+
+
+@receiver(post_migrate)
+def create_recipe_search_index(app_config, using, **kwargs):
+    if app_config.name == 'recipes':
+        create_search_index(using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_counters(sender, instance, created, **kwargs):
+    if created:
+        update_counters(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_counters(sender, instance, **kwargs):
+    update_counters(sender, instance, -1)
+
+
+def update_counters(sender, instance, delta):
+    """
+    Счетчики для записей через ORM: админка, каскадное удаление.
+    Переключатели из toggles меняют счетчики сами.
+    """
+    if sender is Recipe:
+        change_counter(User, [instance.author_id], 'recipes_count', delta)
+    elif sender is Favorite:
+        change_counter(
+            Recipe, [instance.recipe_id], 'favorites_count', delta
+        )
+    else:
+        change_counter(
+            Recipe, [instance.recipe_id], 'in_carts_count', delta
+        )
+
+
+@receiver([post_save, post_delete], sender=RecipeContent)
+def reset_recipe_content_cache(instance, **kwargs):
+    bump_recipe(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def reset_recipe_tags_cache(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_recipe(instance.pk)
+    else:
+        bump_catalog()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def reset_tags_cache(**kwargs):
+    bump_tags()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=MeasureUnit)
+def reset_ingredients_cache(**kwargs):
+    bump_ingredients()
+
+
+@receiver([post_save, post_delete], sender=User)
+def reset_author_cache(update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_catalog()
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+def reset_user_recipes_relations(instance, **kwargs):
+    invalidate_relations(instance.user_id)
+    mark_stale(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Subscribe)
+def reset_user_subscriptions_relations(instance, **kwargs):
+    invalidate_relations(instance.subscriber_id)
+
+
+@receiver(post_save, sender=Subscribe)
+def add_subscription(instance, created, **kwargs):
+    if created:
+        change_counter(User, [instance.author_id], 'followers_count', 1)
+        feed.add_authors(instance.subscriber_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=Subscribe)
+def remove_subscription(instance, **kwargs):
+    change_counter(User, [instance.author_id], 'followers_count', -1)
+    feed.remove_authors(instance.subscriber_id, [instance.author_id])
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feed(instance, created, **kwargs):
+    if created:
+        feed.fan_out([instance.pk])
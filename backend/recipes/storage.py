@@ -0,0 +1,39 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла - sha256 его содержимого:
+    <каталог>/<первые 2 символа>/<хэш>.<расширение>.
+    Повторная загрузка той же картинки не создает новый файл,
+    а содержимое по имени никогда не меняется, поэтому его можно
+    кэшировать навсегда.
+    """
+
+    @staticmethod
+    def content_hash(content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = self.content_hash(content)
+        name = os.path.join(directory, digest[:2], digest + extension)
+        if self.exists(name):
+            # свежий mtime защищает файл от clean_media, пока
+            # ссылающийся на него рецепт еще не сохранен
+            os.utime(self.path(name), None)
+            return name
+        return super()._save(name, content)
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,1064 @@
+import base64
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connections
+from django.test import override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from foodgram.asgi import application
+from foodgram.metrics import registry
+from users.authentication import local_tokens
+from users.models import Subscribe, User
+
+from .bulk import NDJSON_NAME, RecipeImporter
+from .fields import DECODE_CHUNK_SIZE, Base64ImageField
+from .images import generate_thumbnail
+from .matching import match_index
+from .models import (Favorite, Ingredient, MeasureUnit, Recipe, RecipeContent,
+                     ShoppingCart, StaleRecommendation, Tag)
+from .paginator import estimate_count
+from .relations import load_relations
+from .storage import content_storage
+from .views import CART_BATCH_LIMIT
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def image_bytes(color='red', image_format='PNG'):
+    content = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(content, image_format)
+    return content.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class RecipesTestCase(APITestCase):
+    """
+    Общие данные: пользователи, тэги и ингредиенты. Кэши и индексы
+    процесса сбрасываются перед каждым тестом, иначе они переживают
+    откат транзакции.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{number}',
+                email=f'user{number}@example.com',
+                password='password',
+                first_name='Имя',
+                last_name='Фамилия'
+            )
+            for number in range(3)
+        ]
+        cls.user = cls.users[0]
+        cls.tags = [
+            Tag.objects.create(name=f'Тэг {number}', color='#ffffff',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        cls.unit = MeasureUnit.objects.create(unit='г')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit=cls.unit
+            )
+            for number in range(10)
+        ]
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        local_tokens.clear()
+
+    def create_recipe(self, name, author=None, tags=None, ingredients=None):
+        recipe = Recipe.objects.create(
+            name=name,
+            text='Описание',
+            cooking_time=10,
+            author=author or self.user,
+            image=ContentFile(image_bytes(), name='image.png')
+        )
+        recipe.tags.set(tags or self.tags[:1])
+        RecipeContent.objects.bulk_create([
+            RecipeContent(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients or self.ingredients[:3]
+        ])
+        return recipe
+
+
+class RecipeListQueriesTest(RecipesTestCase):
+    """Число запросов списка рецептов не зависит от длины страницы."""
+
+    def assert_list_queries(self, queries):
+        for count in (1, 5):
+            with self.subTest(count=count):
+                Recipe.objects.all().delete()
+                for number in range(count):
+                    self.create_recipe(f'Рецепт {number}')
+                caches['default'].clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get('/api/v1/recipes/?limit=10')
+                self.assertEqual(len(response.data['results']), count)
+
+    def test_anonymous_list(self):
+        # рецепты, count, тэги, состав
+        self.assert_list_queries(4)
+
+    def test_authenticated_list(self):
+        self.client.force_authenticate(self.users[1])
+        # те же запросы и избранное, корзина, подписки одним запросом
+        self.assert_list_queries(5)
+
+
+class RecipeFlagsTest(RecipesTestCase):
+    """Флаги и фильтры по избранному и корзине текущего пользователя."""
+
+    def setUp(self):
+        super().setUp()
+        self.favorite = self.create_recipe('В избранном')
+        self.in_cart = self.create_recipe('В корзине')
+        self.other = self.create_recipe('Другой')
+        Favorite.objects.create(user=self.users[1], recipe=self.favorite)
+        ShoppingCart.objects.create(user=self.users[1], recipe=self.in_cart)
+        self.client.force_authenticate(self.users[1])
+
+    def recipe_ids(self, query):
+        response = self.client.get(f'/api/v1/recipes/?{query}')
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_flags(self):
+        response = self.client.get('/api/v1/recipes/')
+        flags = {
+            recipe['id']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart']
+            )
+            for recipe in response.data['results']
+        }
+        self.assertEqual(flags, {
+            self.favorite.pk: (True, False),
+            self.in_cart.pk: (False, True),
+            self.other.pk: (False, False),
+        })
+
+    def test_filters(self):
+        self.assertEqual(
+            self.recipe_ids('is_favorited=1'), [self.favorite.pk]
+        )
+        self.assertEqual(
+            self.recipe_ids('is_in_shopping_cart=true'), [self.in_cart.pk]
+        )
+        self.assertEqual(
+            self.recipe_ids('is_favorited=0'),
+            [self.other.pk, self.in_cart.pk]
+        )
+
+
+class ShoppingListTest(RecipesTestCase):
+    """Список покупок суммирует ингредиенты рецептов из корзины."""
+
+    def setUp(self):
+        super().setUp()
+        first = self.create_recipe('Первый', ingredients=self.ingredients[:2])
+        second = self.create_recipe(
+            'Второй', ingredients=self.ingredients[1:3]
+        )
+        for recipe in (first, second):
+            ShoppingCart.objects.create(user=self.users[1], recipe=recipe)
+        self.client.force_authenticate(self.users[1])
+
+    def download(self, file_type):
+        return self.client.get(
+            f'/api/v1/recipes/download_shopping_cart/?type={file_type}'
+        )
+
+    def test_text(self):
+        response = self.download('txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode('utf8'),
+            'СПИСОК ПОКУПОК:\n'
+            'ингредиент 0: 1, г\n'
+            'ингредиент 1: 2, г\n'
+            'ингредиент 2: 1, г\n'
+        )
+
+    def test_unknown_type(self):
+        self.assertEqual(self.download('doc').status_code, 400)
+
+    def test_pdf_without_wkhtmltopdf(self):
+        with mock.patch('recipes.exporters.shutil.which', return_value=None):
+            response = self.download('pdf')
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+
+
+class IngredientSearchTest(RecipesTestCase):
+    """Автодополнение ингредиентов по индексу в памяти."""
+
+    def search(self, name):
+        response = self.client.get(f'/api/v1/ingredients/?name={name}')
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_matches_first(self):
+        Ingredient.objects.create(name='соль', measurement_unit=self.unit)
+        Ingredient.objects.create(name='фасоль', measurement_unit=self.unit)
+        self.assertEqual(self.search('соль'), ['соль', 'фасоль'])
+
+    def test_sees_changes_after_version_bump(self):
+        self.assertEqual(self.search('перец'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(
+                name='перец', measurement_unit=self.unit
+            )
+        self.assertEqual(self.search('перец'), ['перец'])
+
+
+class LoadIngredientsTest(RecipesTestCase):
+    """Загрузка ингредиентов пачками, повторный запуск ничего не дублирует."""
+
+    def test_load_twice(self):
+        path = os.path.join(MEDIA_ROOT, 'ingredients.json')
+        with open(path, 'w', encoding='utf8') as file:
+            json.dump([
+                {'name': 'мука', 'measurement_unit': 'г'},
+                {'name': 'яйца', 'measurement_unit': 'шт'},
+                {'name': 'мука', 'measurement_unit': 'кг'},
+            ], file, ensure_ascii=False)
+        before = Ingredient.objects.count()
+        for _ in range(2):
+            call_command('load_ingredients', path, stdout=io.StringIO())
+            self.assertEqual(Ingredient.objects.count(), before + 3)
+        self.assertEqual(
+            set(MeasureUnit.objects.values_list('unit', flat=True)),
+            {'г', 'шт', 'кг'}
+        )
+
+
+class RecipeWriteTest(RecipesTestCase):
+    """Создание и изменение рецепта через API."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients, **fields):
+        data = {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'tags': [self.tags[0].pk],
+            'ingredients': ingredients,
+            'image': 'data:image/png;base64,'
+                     + base64.b64encode(image_bytes()).decode(),
+        }
+        data.update(fields)
+        return data
+
+    def amounts(self, recipe_id):
+        return dict(RecipeContent.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount'))
+
+    def test_update_writes_only_changes(self):
+        first, second, third = self.ingredients[:3]
+        response = self.client.post('/api/v1/recipes/', self.payload([
+            {'id': first.pk, 'amount': 1}, {'id': second.pk, 'amount': 2},
+        ]), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe_id = response.data['id']
+        kept = RecipeContent.objects.get(
+            recipe_id=recipe_id, ingredient=first
+        )
+        response = self.client.patch(f'/api/v1/recipes/{recipe_id}/', {
+            'ingredients': [
+                {'id': first.pk, 'amount': 1},
+                {'id': third.pk, 'amount': 3},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.amounts(recipe_id), {first.pk: 1, third.pk: 3})
+        # неизменный ингредиент не пересоздается
+        self.assertTrue(RecipeContent.objects.filter(pk=kept.pk).exists())
+
+    def test_all_errors_reported(self):
+        response = self.client.post('/api/v1/recipes/', self.payload(
+            [
+                {'id': self.ingredients[0].pk, 'amount': 0},
+                {'id': self.ingredients[0].pk, 'amount': 1},
+                {'id': 999999, 'amount': 1},
+            ],
+            cooking_time=0,
+            tags=[999999]
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            set(response.data),
+            {'cooking_time', 'tags', 'ingredients', 'amount'}
+        )
+
+    def test_missing_amount(self):
+        response = self.client.post('/api/v1/recipes/', self.payload(
+            [{'id': self.ingredients[0].pk}]
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.data['ingredients'][0])
+
+
+class KeysetPaginationTest(RecipesTestCase):
+    """Страницы по курсору: без пропусков и повторов в обе стороны."""
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [
+            self.create_recipe(f'Рецепт {number}').pk
+            for number in range(5)
+        ][::-1]
+
+    def get(self, url):
+        response = self.client.get(url.replace('http://testserver', ''))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_walk_forward_and_back(self):
+        data = self.get('/api/v1/recipes/?cursor=&limit=2')
+        self.assertEqual(data['count'], 5)
+        self.assertIsNone(data['previous'])
+        pages = [[recipe['id'] for recipe in data['results']]]
+        while data['next']:
+            data = self.get(data['next'])
+            pages.append([recipe['id'] for recipe in data['results']])
+        self.assertEqual(sum(pages, []), self.ids)
+        data = self.get(data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']], pages[-2]
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/recipes/?cursor=!!!')
+        self.assertEqual(response.status_code, 404)
+
+    def test_approx_count(self):
+        data = self.get('/api/v1/recipes/?cursor=&count=approx')
+        # на PostgreSQL - оценка планировщика, на других СУБД - точно
+        self.assertIsInstance(data['count'], int)
+
+    def test_approx_count_of_empty_relation(self):
+        data = self.get('/api/v1/recipes/?is_favorited=1&cursor=&count=approx')
+        self.assertEqual(data['count'], 0)
+        self.assertEqual(data['results'], [])
+        queryset = Recipe.objects.filter(id__in=frozenset())
+        connection = connections[queryset.db]
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEqual(estimate_count(queryset), 0)
+
+
+class RecipeCacheTest(RecipesTestCase):
+    """Закэшированная выдача сбрасывается сменой версий после фиксации."""
+
+    def test_list_is_cached_until_change(self):
+        recipe = self.create_recipe('Первый')
+        self.client.get('/api/v1/recipes/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/recipes/')
+        self.assertEqual(response.data['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe('Второй')
+        self.assertEqual(self.client.get('/api/v1/recipes/').data['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Старый'
+            recipe.save()
+        response = self.client.get(f'/api/v1/recipes/{recipe.pk}/')
+        self.assertEqual(response.data['name'], 'Старый')
+
+    def test_detail_lookup_is_normalised(self):
+        recipe = self.create_recipe('Первый')
+        url = f'/api/v1/recipes/0{recipe.pk}/'
+        self.assertEqual(self.client.get(url).data['name'], 'Первый')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Второй'
+            recipe.save()
+        self.assertEqual(self.client.get(url).data['name'], 'Второй')
+
+    def test_etag(self):
+        recipe = self.create_recipe('Первый')
+        url = f'/api/v1/recipes/{recipe.pk}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.client.force_authenticate(self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.users[1], recipe=recipe)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+
+class UserRelationsCacheTest(RecipesTestCase):
+    """Избранное, корзина и подписки берутся из кэша до изменения."""
+
+    def test_relations_cached_and_invalidated(self):
+        recipe = self.create_recipe('Рецепт', author=self.users[2])
+        self.client.force_authenticate(self.users[1])
+        self.client.get('/api/v1/recipes/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/recipes/')
+        self.assertFalse(response.data['results'][0]['is_favorited'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.users[1], recipe=recipe)
+            Subscribe.objects.create(
+                subscriber=self.users[1], author=self.users[2]
+            )
+        result, = self.client.get('/api/v1/recipes/').data['results']
+        self.assertTrue(result['is_favorited'])
+        self.assertTrue(result['author']['is_subscribed'])
+
+    def test_stale_read_does_not_outlive_change(self):
+        recipe = self.create_recipe('Рецепт')
+        self.client.force_authenticate(self.users[1])
+
+        def load_then_change(user_id):
+            # связи прочитаны до того, как параллельный запрос их изменил
+            arrays = load_relations(user_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                Favorite.objects.create(user=self.users[1], recipe=recipe)
+            return arrays
+
+        with mock.patch(
+            'recipes.relations.load_relations', side_effect=load_then_change
+        ):
+            result, = self.client.get('/api/v1/recipes/').data['results']
+        self.assertFalse(result['is_favorited'])
+        result, = self.client.get('/api/v1/recipes/').data['results']
+        self.assertTrue(result['is_favorited'])
+
+
+class RelationToggleTest(RecipesTestCase):
+    """Избранное и корзина одним запросом с RETURNING и счетчиками."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe('Рецепт')
+        self.client.force_authenticate(self.users[1])
+
+    def test_favorite_toggle(self):
+        url = f'/api/v1/recipes/{self.recipe.pk}/favorite/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(
+            self.client.get('/api/v1/recipes/999999/favorite/').status_code,
+            404
+        )
+
+    def test_cart_batch(self):
+        url = '/api/v1/recipes/shopping_cart/'
+        response = self.client.post(
+            url, {'add': [self.recipe.pk, 999999]}, format='json'
+        )
+        self.assertEqual(response.data, {'added': [self.recipe.pk],
+                                         'removed': []})
+        response = self.client.post(
+            url, {'add': [self.recipe.pk], 'remove': [self.recipe.pk]},
+            format='json'
+        )
+        self.assertEqual(response.data, {'added': [],
+                                         'removed': [self.recipe.pk]})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 0)
+
+    def test_cart_batch_rejects_bad_ids(self):
+        url = '/api/v1/recipes/shopping_cart/'
+        for data in ({'add': [True]}, {'remove': 'x'},
+                     {'add': list(range(1, CART_BATCH_LIMIT + 2))}):
+            with self.subTest(data=data):
+                response = self.client.post(url, data, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShoppingCart.objects.exists())
+
+
+class ImageUploadTest(RecipesTestCase):
+    """Картинка в base64 декодируется кусками, миниатюра - после записи."""
+
+    def setUp(self):
+        super().setUp()
+        match_index.invalidate()
+
+    def test_wrapped_base64_over_chunk_size(self):
+        noise = Image.frombytes('RGB', (200, 200), os.urandom(200 * 200 * 3))
+        content = io.BytesIO()
+        noise.save(content, 'PNG')
+        content = content.getvalue()
+        encoded = base64.encodebytes(content).decode()
+        self.assertGreater(len(encoded), DECODE_CHUNK_SIZE)
+        self.assertIn('\n', encoded)
+        upload = Base64ImageField().to_internal_value(
+            'data:image/png;base64,' + encoded
+        )
+        upload.seek(0)
+        self.assertEqual(upload.read(), content)
+        upload.close()
+
+    def test_thumbnail_after_commit(self):
+        recipe = self.create_recipe('Рецепт')
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_thumbnail(recipe)
+        self.assertFalse(recipe.thumbnail)
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.thumbnail.name.endswith('.webp'))
+        with Image.open(recipe.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+
+    def test_lists_use_thumbnail(self):
+        recipe = self.create_recipe('Рецепт', author=self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_thumbnail(recipe)
+        Subscribe.objects.create(subscriber=self.user, author=self.users[1])
+        self.client.force_authenticate(self.user)
+        ingredient = self.ingredients[0].pk
+        for url in ('/api/v1/recipes/', '/api/v1/recipes/feed/',
+                    '/api/v1/recipes/recommended/',
+                    f'/api/v1/recipes/match/?ingredients={ingredient}'):
+            with self.subTest(url=url):
+                result, = self.client.get(url).data['results']
+                self.assertTrue(result['image'].endswith('.webp'))
+        response = self.client.get(f'/api/v1/recipes/{recipe.pk}/')
+        self.assertTrue(response.data['image'].endswith('.png'))
+
+
+class ContentStorageTest(RecipesTestCase):
+    """Одинаковые картинки хранятся одним файлом и не удаляются зря."""
+
+    def test_same_content_same_file(self):
+        first = content_storage.save('images/a.png', ContentFile(b'data'))
+        second = content_storage.save('images/b.PNG', ContentFile(b'data'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith('.png'))
+
+    def test_reuse_refreshes_mtime(self):
+        name = content_storage.save('images/a.png', ContentFile(b'reuse'))
+        path = content_storage.path(name)
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+        content_storage.save('images/a.png', ContentFile(b'reuse'))
+        self.assertGreater(os.path.getmtime(path), old + 60)
+
+        stale = content_storage.save('images/a.png', ContentFile(b'stale'))
+        os.utime(content_storage.path(stale), (old, old))
+        call_command('clean_media', grace=10, stdout=io.StringIO())
+        self.assertTrue(content_storage.exists(name))
+        self.assertFalse(content_storage.exists(stale))
+
+
+@override_settings(ROOT_URLCONF='foodgram.urls_async')
+class MetricsTest(RecipesTestCase):
+    """Server-Timing учитывает запросы синхронного вьюсета под ASGI."""
+
+    def assert_queries_counted(self, response):
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertNotIn('"0 queries"', timing)
+        self.assertIn('recipes-retrieve', registry.render())
+
+    def test_wsgi(self):
+        recipe = self.create_recipe('Рецепт')
+        self.assert_queries_counted(
+            self.client.get(f'/api/v1/recipes/{recipe.id}/')
+        )
+
+    async def test_asgi(self):
+        recipe = await sync_to_async(self.create_recipe)('Рецепт')
+        self.assert_queries_counted(
+            await self.async_client.get(f'/api/v1/recipes/{recipe.id}/')
+        )
+
+
+class CatalogTest(RecipesTestCase):
+    """Справочники отдаются готовыми байтами и обновляются по версии."""
+
+    def test_etag_and_gzip(self):
+        response = self.client.get('/api/v1/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), len(self.tags))
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/v1/tags/', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            '/api/v1/ingredients/', HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            len(json.loads(gzip.decompress(response.content))),
+            len(self.ingredients)
+        )
+
+    def test_rebuild_after_change(self):
+        etag = self.client.get('/api/v1/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', color='#000000', slug='new')
+        response = self.client.get('/api/v1/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('new', [tag['slug'] for tag in response.json()])
+
+
+class CountersTest(RecipesTestCase):
+    """Счетчики меняются вместе со связями и сверяются командой."""
+
+    def test_signals_update_counters(self):
+        author = self.users[1]
+        recipe = self.create_recipe('Рецепт', author=author)
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Subscribe.objects.create(subscriber=self.user, author=author)
+        author.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual(author.recipes_count, 1)
+        self.assertEqual(author.followers_count, 1)
+        self.assertEqual(recipe.favorites_count, 1)
+        recipe.delete()
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 0)
+
+    def test_reconcile_counters(self):
+        recipe = self.create_recipe('Рецепт')
+        ShoppingCart.objects.create(user=self.users[1], recipe=recipe)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            in_carts_count=5, favorites_count=3
+        )
+        User.objects.filter(pk=self.user.pk).update(recipes_count=0)
+        call_command('reconcile_counters', dry_run=True, stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.in_carts_count, 5)
+        output = io.StringIO()
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('Исправлено расхождений: 3.', output.getvalue())
+        recipe.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(recipe.in_carts_count, 1)
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(self.user.recipes_count, 1)
+
+
+class TagFilterTest(RecipesTestCase):
+    """Фильтр по тэгам: любой из тэгов или все сразу, без дублей."""
+
+    def setUp(self):
+        super().setUp()
+        first, second, third = self.tags
+        self.both = self.create_recipe('Оба', tags=[first, second])
+        self.first = self.create_recipe('Первый', tags=[first])
+        self.create_recipe('Третий', tags=[third])
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/v1/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(recipe['id'] for recipe in response.data['results'])
+
+    def test_any(self):
+        self.assertEqual(
+            self.get_ids('tags=tag0&tags=tag1'),
+            sorted([self.both.pk, self.first.pk])
+        )
+        self.assertEqual(
+            self.get_ids('tags=tag1&tags=unknown'), [self.both.pk]
+        )
+
+    def test_all(self):
+        self.assertEqual(
+            self.get_ids('tags=tag0&tags=tag1&tags_match=all'),
+            [self.both.pk]
+        )
+
+    def test_unknown_tags_skip_database(self):
+        self.client.get('/api/v1/tags/')
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/v1/recipes/?tags=tag0&tags=unknown&tags_match=all'
+            )
+        self.assertEqual(response.data['results'], [])
+
+
+class RecipeSearchTest(RecipesTestCase):
+    """Поиск по названию, описанию и составу с ранжированием."""
+
+    def create(self, name, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe(name)
+            recipe.text = text
+            recipe.save()
+        return recipe
+
+    def search(self, term):
+        response = self.client.get('/api/v1/recipes/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_name_ranks_above_text(self):
+        in_text = self.create('Суп', 'Почти борщ')
+        in_name = self.create('Борщ', 'Описание')
+        self.create('Каша', 'Описание')
+        self.assertEqual(self.search('борщ'), [in_name.pk, in_text.pk])
+        self.assertEqual(self.search('борщ суп'), [in_text.pk])
+        self.assertEqual(self.search('плов'), [])
+
+    def test_new_recipe_found(self):
+        self.assertEqual(self.search('плов'), [])
+        recipe = self.create('Плов', 'Описание')
+        self.assertEqual(self.search('плов'), [recipe.pk])
+
+
+class MatchTest(RecipesTestCase):
+    """Подбор рецептов по имеющимся ингредиентам."""
+
+    def setUp(self):
+        super().setUp()
+        match_index.invalidate()
+        first, second, third = self.ingredients[:3]
+        self.full = self.create_recipe('Все есть', ingredients=[first])
+        self.partial = self.create_recipe(
+            'Не хватает', ingredients=[first, second, third]
+        )
+        self.create_recipe('Другое', ingredients=[self.ingredients[5]])
+
+    def match(self, query):
+        return self.client.get(f'/api/v1/recipes/match/?{query}')
+
+    def test_order_and_counts(self):
+        first = self.ingredients[0].pk
+        response = self.match(f'ingredients={first}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(recipe['id'], recipe['matched_count'],
+              recipe['missing_count'])
+             for recipe in response.data['results']],
+            [(self.full.pk, 1, 0), (self.partial.pk, 1, 2)]
+        )
+        response = self.match(f'ingredients={first}&max_missing=0')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.full.pk]
+        )
+
+    def test_refresh_after_change(self):
+        first = self.ingredients[0].pk
+        self.match(f'ingredients={first}')
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeContent.objects.create(
+                recipe=self.full, ingredient=self.ingredients[1], amount=1
+            )
+        response = self.match(f'ingredients={first}')
+        self.assertEqual(response.data['results'][0]['missing_count'], 1)
+
+    def test_bad_ingredients(self):
+        self.assertEqual(self.match('ingredients=x').status_code, 400)
+        self.assertEqual(self.match('').status_code, 400)
+
+
+class RecommendationsTest(RecipesTestCase):
+    """Рекомендации по сходству рецептов в избранном."""
+
+    def setUp(self):
+        super().setUp()
+        self.first = self.create_recipe('Первый')
+        self.second = self.create_recipe('Второй')
+        self.third = self.create_recipe('Третий')
+        for user, recipe in ((self.users[1], self.first),
+                             (self.users[1], self.second),
+                             (self.users[2], self.first)):
+            Favorite.objects.create(user=user, recipe=recipe)
+
+    def recommended(self, user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        response = self.client.get('/api/v1/recipes/recommended/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_popular_without_recommendations(self):
+        self.assertEqual(
+            self.recommended(),
+            [self.first.pk, self.second.pk, self.third.pk]
+        )
+        self.assertEqual(self.recommended(self.users[2])[0], self.first.pk)
+
+    def test_build_and_incremental_refresh(self):
+        call_command('build_recommendations', stdout=io.StringIO())
+        self.assertEqual(self.recommended(self.users[2]), [self.second.pk])
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/api/v1/recipes/{self.first.pk}/favorite/')
+        self.assertTrue(
+            StaleRecommendation.objects.filter(user=self.user).exists()
+        )
+        call_command(
+            'build_recommendations', incremental=True, stdout=io.StringIO()
+        )
+        self.assertFalse(StaleRecommendation.objects.exists())
+        self.assertEqual(self.recommended(), [self.second.pk])
+
+
+class FeedTest(RecipesTestCase):
+    """Лента подписок из таблицы FeedEntry."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.users[1]
+        self.client.force_authenticate(self.user)
+
+    def feed(self, query=''):
+        response = self.client.get(f'/api/v1/recipes/feed/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def feed_ids(self):
+        return [recipe['id'] for recipe in self.feed().data['results']]
+
+    def test_subscribe_fan_out_and_unsubscribe(self):
+        old = self.create_recipe('Старый', author=self.author)
+        self.create_recipe('Чужой', author=self.users[2])
+        Subscribe.objects.create(subscriber=self.user, author=self.author)
+        self.assertEqual(self.feed_ids(), [old.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            new = self.create_recipe('Новый', author=self.author)
+        self.assertEqual(self.feed_ids(), [new.pk, old.pk])
+        Subscribe.objects.filter(subscriber=self.user).delete()
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_count_is_not_computed(self):
+        Subscribe.objects.create(subscriber=self.user, author=self.author)
+        self.create_recipe('Рецепт', author=self.author)
+        self.assertIsNone(self.feed().data['count'])
+        self.assertIsNotNone(self.feed('?count=approx').data['count'])
+
+    def test_backfill_command(self):
+        recipe = self.create_recipe('Рецепт', author=self.author)
+        Subscribe.objects.bulk_create([
+            Subscribe(subscriber=self.user, author=self.author),
+            Subscribe(subscriber=self.users[2], author=self.author),
+        ])
+        self.assertEqual(self.feed_ids(), [])
+        output = io.StringIO()
+        call_command('backfill_feed', stdout=output)
+        self.assertIn('добавлено записей: 2', output.getvalue())
+        self.assertEqual(self.feed_ids(), [recipe.pk])
+        call_command('backfill_feed', user=[self.user.pk], stdout=output)
+        self.assertIn('добавлено записей: 0', output.getvalue())
+
+
+class BulkImportExportTest(RecipesTestCase):
+    """Массовый импорт и выгрузка рецептов в NDJSON и zip."""
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        self.image = content_storage.save(
+            'images/import.png', ContentFile(image_bytes())
+        )
+
+    def record(self, name, **fields):
+        ingredient = self.ingredients[0]
+        record = {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 5,
+            'tags': ['tag0', self.tags[1].pk],
+            'ingredients': [
+                {'name': ingredient.name, 'measurement_unit': 'г',
+                 'amount': 2},
+                {'id': self.ingredients[1].pk, 'amount': 3},
+            ],
+            'image': self.image,
+        }
+        record.update(fields)
+        return json.dumps(record, ensure_ascii=False)
+
+    def import_lines(self, *lines):
+        return self.client.post(
+            '/api/v1/recipes/import/', '\n'.join(lines).encode(),
+            content_type='application/x-ndjson'
+        )
+
+    def export(self, export_type):
+        response = self.client.get(
+            '/api/v1/recipes/export/', {'type': export_type}
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def snapshot(self):
+        return [
+            (recipe.name, recipe.author_id,
+             sorted(recipe.tags.values_list('slug', flat=True)),
+             sorted(recipe.recipe_content.values_list(
+                 'ingredient_id', 'amount'
+             )))
+            for recipe in Recipe.objects.order_by('name')
+        ]
+
+    def test_ndjson_import(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.import_lines(
+                self.record('Первый'), '', self.record('Второй')
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data, {'created': 2, 'errors': []})
+        recipe = Recipe.objects.get(name='Первый')
+        self.assertEqual(recipe.image.name, self.image)
+        self.assertEqual(
+            sorted(recipe.tags.values_list('slug', flat=True)),
+            ['tag0', 'tag1']
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 2)
+
+    def test_batch_with_errors_is_not_written(self):
+        importer = RecipeImporter(author=self.user, batch_size=2)
+        result = importer.run([
+            self.record('Первый'),
+            self.record('Второй', tags=[], cooking_time=0),
+            self.record('Третий'),
+            'не json',
+        ])
+        self.assertEqual(result['created'], 0)
+        self.assertEqual(
+            [error['line'] for error in result['errors']], [2, 4]
+        )
+        self.assertEqual(
+            set(result['errors'][0]['errors']), {'tags', 'cooking_time'}
+        )
+        result = importer.run([self.record('Первый'), self.record('Первый')])
+        self.assertEqual(result['errors'][0]['line'], 2)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(
+            self.import_lines(self.record('Первый', image='x.png'))
+            .status_code,
+            400
+        )
+
+    def test_only_admin(self):
+        self.client.force_authenticate(self.users[1])
+        self.assertEqual(self.import_lines().status_code, 403)
+        self.assertEqual(
+            self.client.get('/api/v1/recipes/export/').status_code, 403
+        )
+
+    def test_ndjson_round_trip(self):
+        self.create_recipe('Первый', tags=self.tags[:2])
+        self.create_recipe('Второй', author=self.users[1])
+        expected = self.snapshot()
+        content = self.export('ndjson')
+        Recipe.objects.all().delete()
+        response = self.import_lines(*content.decode().splitlines())
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_zip_round_trip(self):
+        recipe = self.create_recipe('Первый', tags=self.tags[:2])
+        expected = self.snapshot()
+        content = self.export('zip')
+        image = recipe.image.name
+        Recipe.objects.all().delete()
+        content_storage.delete(image)
+        response = self.client.post(
+            '/api/v1/recipes/import/', content,
+            content_type='application/zip'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertTrue(content_storage.exists(image))
+
+    async def asgi_get(self, path, query=b''):
+        """Запрос через ASGI-приложение, как под uvicorn."""
+        token, _ = await sync_to_async(Token.objects.get_or_create)(
+            user=self.user
+        )
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': path,
+            'query_string': query,
+            'headers': [
+                (b'authorization', f'Token {token.key}'.encode()),
+            ],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        # как тестовый клиент: соединение теста не закрывается
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with override_settings(ROOT_URLCONF='foodgram.urls_async'):
+                await application(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        start, *body = messages
+        self.assertFalse(body[-1].get('more_body', False))
+        return start['status'], b''.join(
+            message.get('body', b'') for message in body
+        )
+
+    async def test_export_under_asgi(self):
+        await sync_to_async(self.create_recipe)('Первый')
+        await sync_to_async(self.create_recipe)('Второй')
+        status, content = await self.asgi_get(
+            '/api/v1/recipes/export/', b'type=ndjson'
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            [json.loads(line)['name'] for line in content.splitlines()],
+            ['Первый', 'Второй']
+        )
+        status, content = await self.asgi_get(
+            '/api/v1/recipes/export/', b'type=zip'
+        )
+        self.assertEqual(status, 200)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(
+                len(archive.read(NDJSON_NAME).splitlines()), 2
+            )
+
+    async def test_shopping_list_under_asgi(self):
+        recipe = await sync_to_async(self.create_recipe)('Первый')
+        await sync_to_async(ShoppingCart.objects.create)(
+            user=self.user, recipe=recipe
+        )
+        status, content = await self.asgi_get(
+            '/api/v1/recipes/download_shopping_cart/', b'type=txt'
+        )
+        self.assertEqual(status, 200)
+        self.assertIn(self.ingredients[0].name, content.decode())
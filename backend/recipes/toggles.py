@@ -0,0 +1,115 @@
+from django.db import connections, transaction
+
+from users.models import Subscribe
+from . import feed
+from .counters import change_counter
+from .models import Favorite, ShoppingCart
+from .recommendations import mark_stale
+from .relations import invalidate_relations
+
+
+class RelationToggle:
+    """
+    Добавление и удаление связей пользователь - объект одним запросом:
+    INSERT ... ON CONFLICT DO NOTHING RETURNING и DELETE ... RETURNING.
+    По возвращенным строкам видно, что реально изменилось, поэтому
+    нет гонки между проверкой и записью и ошибок уникальности.
+    Если задан counter, счетчик у объектов меняется в той же
+    транзакции и только для реально измененных связей. on_add и
+    on_remove вызываются с id владельца и списком измененных id.
+    """
+
+    def __init__(self, model, owner_field, target_field, counter=None,
+                 on_add=None, on_remove=None):
+        self.model = model
+        self.owner_field = model._meta.get_field(owner_field)
+        self.target_field = model._meta.get_field(target_field)
+        self.counter = counter
+        self.on_add = on_add
+        self.on_remove = on_remove
+
+    @staticmethod
+    def changed(owner_id, target_ids, callback):
+        invalidate_relations(owner_id)
+        if callback is not None:
+            callback(owner_id, target_ids)
+
+    def update_counter(self, target_ids, delta):
+        if self.counter is not None:
+            change_counter(
+                self.target_field.related_model, target_ids,
+                self.counter, delta
+            )
+
+    def execute(self, sql, params):
+        with connections[self.model.objects.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def names(self, connection):
+        quote = connection.ops.quote_name
+        target_model = self.target_field.related_model._meta
+        return {
+            'table': quote(self.model._meta.db_table),
+            'owner': quote(self.owner_field.column),
+            'target': quote(self.target_field.column),
+            'target_table': quote(target_model.db_table),
+            'target_pk': quote(target_model.pk.column),
+        }
+
+    def add(self, owner_id, target_ids):
+        """Возвращает id объектов, связь с которыми была создана."""
+        target_ids = list(target_ids)
+        if not target_ids:
+            return []
+        names = self.names(connections[self.model.objects.db])
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        with transaction.atomic(using=self.model.objects.db):
+            added = self.execute(
+                'INSERT INTO {table} ({owner}, {target}) '
+                'SELECT %s, {target_pk} FROM {target_table} '
+                f'WHERE {{target_pk}} IN ({placeholders}) '
+                'ON CONFLICT DO NOTHING RETURNING {target}'.format(**names),
+                [owner_id, *target_ids]
+            )
+            self.update_counter(added, 1)
+        if added:
+            self.changed(owner_id, added, self.on_add)
+        return added
+
+    def remove(self, owner_id, target_ids):
+        """Возвращает id объектов, связь с которыми была удалена."""
+        target_ids = list(target_ids)
+        if not target_ids:
+            return []
+        names = self.names(connections[self.model.objects.db])
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        with transaction.atomic(using=self.model.objects.db):
+            removed = self.execute(
+                'DELETE FROM {table} WHERE {owner} = %s '
+                f'AND {{target}} IN ({placeholders}) '
+                'RETURNING {target}'.format(**names),
+                [owner_id, *target_ids]
+            )
+            self.update_counter(removed, -1)
+        if removed:
+            self.changed(owner_id, removed, self.on_remove)
+        return removed
+
+
+def stale_recommendations(user_id, recipe_ids):
+    mark_stale(user_id)
+
+
+favorites = RelationToggle(
+    Favorite, 'user', 'recipe', counter='favorites_count',
+    on_add=stale_recommendations, on_remove=stale_recommendations
+)
+shopping_cart = RelationToggle(
+    ShoppingCart, 'user', 'recipe', counter='in_carts_count',
+    on_add=stale_recommendations, on_remove=stale_recommendations
+)
+subscriptions = RelationToggle(
+    Subscribe, 'subscriber', 'author', counter='followers_count',
+    on_add=feed.add_authors, on_remove=feed.remove_authors
+)
@@ -1,124 +1,256 @@
-from django.db.models import Case, CharField, Sum, Value, When
+import shutil
+import tempfile
+import zipfile
+
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from foodgram.metrics import MetricsMixin
 from users.serializers import PartialRecipeSerializer
-from .filters import CustomFilterBackend, CustomSearch
-from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
-from .paginator import CustomPagePaginator
+
+from . import toggles
+from .bulk import (NDJSON_NAME, RecipeImporter, ZipImages, export_lines,
+                   export_zip)
+from .cache import RecipeCacheMixin
+from .catalog import catalog_response, ingredients_catalog, tags_catalog
+from .exporters import WRITERS, shopping_list_rows
+from .feed import pull_popular_authors
+from .filters import CustomFilterBackend
+from .matching import match_index
+from .models import FeedEntry, Ingredient, Recipe, Tag
+from .paginator import CustomPagePaginator, FeedPaginator, KeysetPagePaginator
 from .permissions import IsOwnerOrReadOnly
+from .planner import plan_queryset
+from .recommendations import RECOMMENDATIONS_SIZE
 from .renders import BinaryFileRenderer
+from .search import ingredient_index
 from .serializers import IngredientSerializer, RecipeSerializer, TagSerializer
 
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl')
+ZIP_TYPES = ('application/zip', 'application/x-zip-compressed')
+CART_BATCH_LIMIT = 500
+
+
+class CatalogMixin:
+    """
+    Полный список справочника отдается готовыми байтами из памяти
+    процесса. Обычная сериализация остается для browsable API.
+    """
+    catalog = None
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        return catalog_response(request, self.catalog.get())
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagsViewSet(MetricsMixin, CatalogMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     queryset = Tag.objects.all()
     pagination_class = None
+    catalog = tags_catalog
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(MetricsMixin, CatalogMixin,
+                         viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
-    queryset = Ingredient.objects.all()
+    queryset = Ingredient.objects.select_related('measurement_unit')
     pagination_class = None
-    filter_backends = [CustomSearch]
-    search_fields = ['^name']
+    # поиск по ?name= идет по индексу в памяти, а не по базе
+    filter_backends = []
+    catalog = ingredients_catalog
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        return Response(ingredient_index.search(
+            name, int(limit) if limit and limit.isdigit() else None
+        ))
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(MetricsMixin, RecipeCacheMixin, viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
     permission_classes = [IsOwnerOrReadOnly]
     queryset = Recipe.objects.all()
-    pagination_class = CustomPagePaginator
+    pagination_class = KeysetPagePaginator
     filter_backends = [CustomFilterBackend]
 
     def get_queryset(self):
-        user = self.request.user
-        fav = Favorite.objects.filter(
-            user=user.pk
-        ).values_list('recipe_id', flat=True).distinct()
-        shop = ShoppingCart.objects.filter(
-            user=user.pk
-        ).values_list('recipe_id', flat=True).distinct()
-        queryset = super().get_queryset()
-        queryset = queryset.annotate(
-            is_favorited=Case(
-                When(id__in=fav, then=Value('true')),
-                output_field=CharField(),
-                default=Value('false')
-            )
-        ).annotate(
-            is_in_shopping_cart=Case(
-                When(id__in=shop, then=Value('true')),
-                output_field=CharField(),
-                default=Value('false')
-            )
-        )
-        return queryset
+        return plan_queryset(
+            super().get_queryset(), self.get_serializer_class()
+        ).defer('search_vector').order_by('-id')
 
     @action(detail=True,
             permission_classes=[IsAuthenticated],
             methods=['GET', 'DELETE'],
             url_path='favorite')
     def favorite(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
-        exists = Favorite.objects.filter(
-            user=request.user,
-            recipe=recipe
-        ).exists()
-        if request.method == 'GET':
-            if exists:
+        return self.toggle(
+            request, pk, toggles.favorites,
+            'Already in favorites', 'Not in favorites'
+        )
+
+    @action(detail=True,
+            permission_classes=[IsAuthenticated],
+            methods=['GET', 'DELETE'],
+            url_path='shopping_cart')
+    def shopping_cart(self, request, pk=None):
+        return self.toggle(
+            request, pk, toggles.shopping_cart,
+            'Already in shopping cart', 'Not in shopping cart'
+        )
+
+    @action(detail=False,
+            permission_classes=[IsAuthenticated],
+            methods=['POST'],
+            url_path='shopping_cart')
+    def shopping_cart_batch(self, request):
+        """
+        Пакетное изменение корзины: {"add": [id, ...], "remove": [...]}.
+        Несуществующие рецепты и уже выполненные изменения пропускаются.
+        """
+        ids = {}
+        for key in ('add', 'remove'):
+            values = request.data.get(key, [])
+            # bool - подкласс int: true и false не должны стать id 1 и 0
+            if not isinstance(values, list) or not all(
+                isinstance(value, int) and not isinstance(value, bool)
+                for value in values
+            ):
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
-                    data={'errors': 'Already in favorites'}
+                    data={key: ['Ожидается список id рецептов.']}
                 )
-            Favorite.objects.create(user=request.user, recipe=recipe)
-            serializer = PartialRecipeSerializer(recipe)
-            return Response(serializer.data)
-        else:
-            if not exists:
+            if len(values) > CART_BATCH_LIMIT:
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
-                    data={'errors': 'Not in favorites'}
+                    data={key: [
+                        f'Не больше {CART_BATCH_LIMIT} рецептов за запрос.'
+                    ]}
                 )
-            Favorite.objects.filter(user=request.user, recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            ids[key] = values
+        return Response({
+            'added': toggles.shopping_cart.add(request.user.pk, ids['add']),
+            'removed': toggles.shopping_cart.remove(
+                request.user.pk, ids['remove']
+            ),
+        })
 
-    @action(detail=True,
+    @action(detail=False,
+            methods=['GET'],
+            url_path='match',
+            pagination_class=CustomPagePaginator)
+    def match(self, request):
+        """
+        Рецепты по имеющимся ингредиентам: ?ingredients=1&ingredients=2,
+        необязательно ?max_missing=N. К каждому рецепту добавляются
+        matched_count и missing_count.
+        """
+        values = request.query_params.getlist('ingredients')
+        max_missing = request.query_params.get('max_missing', '')
+        if not values or not all(value.isdigit() for value in values):
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'ingredients': ['Ожидается список id ингредиентов.']}
+            )
+        matches = match_index.match(
+            map(int, values),
+            int(max_missing) if max_missing.isdigit() else None
+        )
+        page = self.paginate_queryset(matches)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        page = [item for item in page if item[0] in recipes]
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True
+        )
+        data = serializer.data
+        for item, (_, matched, missing) in zip(data, page):
+            item['matched_count'] = matched
+            item['missing_count'] = missing
+        return self.get_paginated_response(data)
+
+    @action(detail=False,
+            methods=['GET'],
+            url_path='recommended',
+            pagination_class=CustomPagePaginator)
+    def recommended(self, request):
+        """
+        Рекомендации пользователя из заранее рассчитанного top-K.
+        Анонимным и новым пользователям - популярные рецепты.
+        """
+        queryset = self.get_queryset()
+        popular = queryset.order_by('-favorites_count', '-id')[
+            :RECOMMENDATIONS_SIZE
+        ]
+        if request.user.is_authenticated:
+            recommended = queryset.filter(
+                recommendations__user=request.user
+            ).order_by('-recommendations__score', '-id')
+            queryset = recommended if recommended.exists() else popular
+        else:
+            queryset = popular
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False,
             permission_classes=[IsAuthenticated],
-            methods=['GET', 'DELETE'],
-            url_path='shopping_cart')
-    def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
-        exists = ShoppingCart.objects.filter(
-            user=request.user,
-            recipe=recipe
-        ).exists()
+            methods=['GET'],
+            url_path='feed',
+            pagination_class=FeedPaginator)
+    def feed(self, request):
+        """
+        Новые рецепты авторов из подписок. Страница ленты - один
+        диапазон индекса (user, recipe) таблицы ленты, рецепты
+        загружаются только для этой страницы.
+        """
+        pull_popular_authors(request.user.pk)
+        entries = FeedEntry.objects.filter(user=request.user).only(
+            'recipe_id'
+        )
+        page = self.paginate_queryset(entries)
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in page]
+        )
+        serializer = self.get_serializer(
+            [
+                recipes[entry.recipe_id] for entry in page
+                if entry.recipe_id in recipes
+            ],
+            many=True
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def toggle(request, pk, relation, exists_message, missing_message):
+        if not str(pk).isdigit():
+            raise Http404
         if request.method == 'GET':
-            if exists:
+            recipe = get_object_or_404(Recipe, id=pk)
+            if not relation.add(request.user.pk, [recipe.pk]):
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
-                    data={'errors': 'Already in shopping cart'}
+                    data={'errors': exists_message}
                 )
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
             serializer = PartialRecipeSerializer(recipe)
             return Response(serializer.data)
-        else:
-            if not exists:
-                return Response(
-                    status=status.HTTP_400_BAD_REQUEST,
-                    data={'errors': 'Not in shopping cart'}
-                )
-            ShoppingCart.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        if not relation.remove(request.user.pk, [int(pk)]):
+            get_object_or_404(Recipe, id=pk)
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'errors': missing_message}
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             permission_classes=[IsAuthenticated],
@@ -126,26 +258,100 @@ class RecipesViewSet(viewsets.ModelViewSet):
             url_path='download_shopping_cart',
             renderer_classes=(BinaryFileRenderer,))
     def download_shopping_cart(self, request):
-        shopping_list = ShoppingCart.objects.filter(
-            user=request.user
-        ).values(
-            'recipe__ingredients__name',
-            'recipe__ingredients__measurement_unit__unit').annotate(
-            total=Sum('recipe__recipe_content__amount')
-        ).values_list(
-            'recipe__ingredients__name',
-            'total',
-            'recipe__ingredients__measurement_unit__unit'
+        writer_class = WRITERS.get(request.query_params.get('type', 'txt'))
+        if writer_class is None:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'errors': f'Available types: {", ".join(WRITERS)}'}
+            )
+        if not writer_class.available():
+            # проверка до StreamingHttpResponse: после заголовков 200
+            # ошибку уже не отдать, клиент получил бы обрезанный файл
+            return Response(
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+                data={'errors': f'Type {writer_class.extension} '
+                                'is not available on this server'}
+            )
+        response = StreamingHttpResponse(
+            writer_class().write(shopping_list_rows(request.user)),
+            content_type=writer_class.content_type
         )
-        text = 'СПИСОК ПОКУПОК:\n'
-        headers = {
-            'Content-Disposition': 'attachment; filename="shopping_list.txt"'
-        }
-        for line in shopping_list:
-            text += (str(line[0]) + ': ' + str(line[1]) +
-                     ', ' + str(line[2]) + '\n')
+        response['Content-Disposition'] = (
+            'attachment; filename="shopping_list.'
+            f'{writer_class.extension}"'
+        )
+        return response
+
+    @action(detail=False,
+            permission_classes=[IsAdminUser],
+            methods=['POST'],
+            url_path='import')
+    def import_recipes(self, request):
+        """
+        Массовый импорт: тело - NDJSON с рецептами или zip-архив
+        с recipes.ndjson и картинками. Тело читается потоком, без
+        разбора в request.data. Рецепты без автора записываются
+        на текущего пользователя.
+        """
+        content_type = request.content_type.split(';')[0].strip()
+        importer = RecipeImporter(author=request.user)
+        stream = request.stream or ()
+        if content_type in NDJSON_TYPES:
+            result = importer.run(stream)
+        elif content_type in ZIP_TYPES:
+            with tempfile.TemporaryFile() as upload:
+                if stream:
+                    shutil.copyfileobj(stream, upload)
+                upload.seek(0)
+                try:
+                    with zipfile.ZipFile(upload) as archive, archive.open(
+                        NDJSON_NAME
+                    ) as lines:
+                        importer.images = ZipImages(archive)
+                        result = importer.run(lines)
+                except (zipfile.BadZipFile, KeyError):
+                    return Response(
+                        status=status.HTTP_400_BAD_REQUEST,
+                        data={'errors': 'Ожидается zip-архив с файлом '
+                                        f'{NDJSON_NAME}.'}
+                    )
+        else:
+            return Response(
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                data={'errors': 'Available types: '
+                                f'{", ".join(NDJSON_TYPES + ZIP_TYPES)}'}
+            )
         return Response(
-            data=bytes(text.encode('utf8')),
-            headers=headers,
-            content_type='application/txt'
+            status=(status.HTTP_400_BAD_REQUEST if result['errors']
+                    else status.HTTP_201_CREATED),
+            data=result
+        )
+
+    @action(detail=False,
+            permission_classes=[IsAdminUser],
+            methods=['GET'],
+            url_path='export',
+            renderer_classes=(BinaryFileRenderer,))
+    def export_recipes(self, request):
+        """
+        Выгрузка всех рецептов в формате импорта: NDJSON или
+        с ?type=zip архив с картинками. Отдается потоком.
+        """
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type == 'zip':
+            response = StreamingHttpResponse(
+                export_zip(), content_type='application/zip'
+            )
+        elif export_type == 'ndjson':
+            response = StreamingHttpResponse(
+                export_lines(), content_type=NDJSON_TYPES[0]
+            )
+        else:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'errors': 'Available types: ndjson, zip'}
+            )
+        response['Content-Disposition'] = (
+            f'attachment; filename="recipes.{export_type}"'
         )
+        return response
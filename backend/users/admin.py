@@ -9,7 +9,10 @@ User = get_user_model()
 
 class ManualUser(UserAdmin):
     model = User
-    list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff')
+    list_display = (
+        'username', 'email', 'first_name', 'last_name', 'is_staff',
+        'recipes_count'
+    )
 
 
 admin.site.register(User, ManualUser)
@@ -0,0 +1,144 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+TOKEN_KEY = 'auth:token:{}'
+TOKEN_TIMEOUT = getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 300)
+LOCAL_SIZE = getattr(settings, 'AUTH_TOKEN_LOCAL_SIZE', 1024)
+LOCAL_TTL = getattr(settings, 'AUTH_TOKEN_LOCAL_TTL', 10)
+
+User = get_user_model()
+
+
+class LocalTokenCache:
+    """
+    LRU-кэш процесса с ограниченным временем жизни записей.
+    Срок короткий: при общем кэше (Redis, Memcached) сброс доходит
+    до других воркеров не позже, чем истечет локальная запись.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_tokens = LocalTokenCache(LOCAL_SIZE, LOCAL_TTL)
+
+
+def get_cache():
+    return caches[getattr(settings, 'AUTH_TOKEN_CACHE', 'default')]
+
+
+def cache_timeout(cache):
+    """
+    LocMemCache у каждого воркера свой, и сброс из invalidate_tokens
+    до других воркеров не доходит. Тогда записи живут столько же,
+    сколько в локальном кэше.
+    """
+    if isinstance(cache, LocMemCache):
+        return min(TOKEN_TIMEOUT, LOCAL_TTL)
+    return TOKEN_TIMEOUT
+
+
+def cache_key(token):
+    # сам токен в ключи кэша не попадает
+    return TOKEN_KEY.format(hashlib.sha256(token.encode()).hexdigest())
+
+
+def invalidate_tokens(*tokens):
+    """Сбрасывает закэшированных пользователей после фиксации транзакции."""
+    keys = [cache_key(token) for token in tokens]
+    if not keys:
+        return
+
+    def delete():
+        for key in keys:
+            local_tokens.delete(key)
+        get_cache().delete_many(keys)
+    transaction.on_commit(delete)
+
+
+class CachedUser(SimpleLazyObject):
+    """
+    Пользователь из кэша токенов: id и is_active известны сразу,
+    остальные поля загружаются из базы при первом обращении.
+    """
+
+    def __init__(self, user_id, is_active):
+        super().__init__(lambda: User.objects.get(pk=user_id))
+        self.__dict__.update(
+            id=user_id,
+            pk=user_id,
+            is_active=is_active,
+            is_authenticated=True,
+            is_anonymous=False,
+        )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к базе на каждый вызов API.
+    Токен ищется сначала в LRU-кэше процесса, затем в общем кэше
+    и только потом в базе. В кэше хранятся только id пользователя,
+    его is_active и ключ токена, без остальных полей учетной записи.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_name = cache_key(key)
+        data = local_tokens.get(cache_name)
+        if data is None:
+            cache = get_cache()
+            data = cache.get(cache_name)
+            if data is None:
+                user, token = super().authenticate_credentials(key)
+                data = (user.pk, user.is_active, token.key)
+                cache.set(cache_name, data, cache_timeout(cache))
+            local_tokens.set(cache_name, data)
+        user_id, is_active, token_key = data
+        if not is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        user = CachedUser(user_id, is_active)
+        return user, Token(key=token_key, user_id=user_id)
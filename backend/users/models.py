@@ -3,7 +3,28 @@ from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
 
 
-class User(AbstractUser):
+class DatabaseFieldsMixin:
+    """
+    Поля database_fields (счетчики, поисковый вектор) меняются только
+    запросами в базе. Обычный save() существующей записи их не трогает,
+    чтобы не записать обратно устаревшее значение из памяти.
+    """
+    database_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            skipped = set(self.database_fields) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+                and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(DatabaseFieldsMixin, AbstractUser):
     """
     Класс пользователей
     """
@@ -34,8 +55,19 @@ class User(AbstractUser):
         },
     )
     password = models.CharField('пароль', max_length=150, blank=False)
+    recipes_count = models.PositiveIntegerField(
+        'число рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'число подписчиков',
+        default=0,
+        editable=False
+    )
 
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name', 'password']
+    database_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
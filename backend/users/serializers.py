@@ -3,10 +3,12 @@ from djoser.serializers import UserCreateSerializer
 from rest_framework import serializers
 
 from recipes.models import Recipe
-from .models import Subscribe
+from recipes.relations import get_relations
 
 User = get_user_model()
 
+RECIPES_LIMIT = 3
+
 
 class UserSerializer(serializers.ModelSerializer):
 
@@ -19,12 +21,7 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if not user.pk:
-            return False
-        if Subscribe.objects.filter(subscriber=user, author=obj).exists():
-            return True
-        return False
+        return get_relations(self.context['request']).is_subscribed(obj.pk)
 
 
 class UsersCreateSerializer(UserCreateSerializer):
@@ -43,7 +40,7 @@ class PartialRecipeSerializer(serializers.ModelSerializer):
 
 class SubscribeSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         fields = (
@@ -55,11 +52,17 @@ class SubscribeSerializer(UserSerializer):
             'password': {'write_only': True},
         }
 
+    def get_is_subscribed(self, obj):
+        # выдается только для авторов из подписок пользователя
+        return True
+
     def get_recipes(self, obj):
-        limit = self.context['request'].query_params.get('recipes_limit', 3)
-        queryset = obj.recipes.all()[:int(limit)]
+        queryset = getattr(obj, 'top_recipes', None)
+        if queryset is None:
+            limit = self.context['request'].query_params.get(
+                'recipes_limit', ''
+            )
+            limit = int(limit) if limit.isdigit() else RECIPES_LIMIT
+            queryset = obj.recipes.order_by('-id')[:limit]
         serializer = PartialRecipeSerializer(queryset, many=True)
         return serializer.data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .models import User
+
+
+@receiver(post_delete, sender=Token)
+def reset_deleted_token(instance, **kwargs):
+    # выход (token_destroy), в том числе после смены пароля
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def reset_user_tokens(instance, created, update_fields=None, **kwargs):
+    """Смена пароля, деактивация и любые другие правки пользователя."""
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_tokens(
+        *Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
@@ -0,0 +1,150 @@
+import tempfile
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from recipes.tests import RecipesTestCase
+from users.authentication import (LOCAL_TTL, TOKEN_TIMEOUT,
+                                  CachedTokenAuthentication, cache_key,
+                                  cache_timeout, get_cache, local_tokens)
+from users.models import Subscribe, User
+
+
+class SubscriptionsPageTest(RecipesTestCase):
+    """Страница подписок: последние рецепты авторов и их число."""
+
+    def setUp(self):
+        super().setUp()
+        self.subscriber = self.users[0]
+        self.client.force_authenticate(self.subscriber)
+
+    def subscribe(self, author, recipes):
+        Subscribe.objects.create(subscriber=self.subscriber, author=author)
+        return [
+            self.create_recipe(f'{author.username} {number}', author=author)
+            for number in range(recipes)
+        ]
+
+    def test_recipes_limit(self):
+        recipes = self.subscribe(self.users[1], 3)
+        response = self.client.get(
+            '/api/v1/users/subscriptions/?recipes_limit=2'
+        )
+        self.assertEqual(response.status_code, 200)
+        author, = response.data['results']
+        self.assertEqual(author['recipes_count'], 3)
+        self.assertEqual(
+            [recipe['id'] for recipe in author['recipes']],
+            [recipes[2].pk, recipes[1].pk]
+        )
+
+    def test_queries_do_not_depend_on_authors(self):
+        queries = []
+        for number in range(3):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='password'
+            )
+            self.subscribe(author, 2)
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/v1/users/subscriptions/')
+            self.assertEqual(len(response.data['results']), number + 1)
+            queries.append(len(captured))
+        self.assertEqual(len(set(queries)), 1, queries)
+
+    def test_recipes_ranked_only_for_page_authors(self):
+        for author in self.users[1:]:
+            self.subscribe(author, 2)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/v1/users/subscriptions/?limit=1')
+        author, = response.data['results']
+        ranked, = [
+            query['sql'] for query in captured
+            if 'ROW_NUMBER' in query['sql'].upper()
+        ]
+        self.assertIn(f'IN ({author["id"]})', ranked)
+        self.assertNotIn(Subscribe._meta.db_table, ranked)
+
+
+class TokenCacheTest(RecipesTestCase):
+    """Токен ищется в базе один раз, до выхода или правки пользователя."""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(
+                '/api/v1/users/me/',
+                HTTP_AUTHORIZATION=f'Token {self.token.key}'
+            )
+        token_queries = [
+            query for query in captured
+            if Token._meta.db_table in query['sql']
+        ]
+        return response, len(token_queries)
+
+    def test_cached_lookup(self):
+        response, queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+        local_tokens.clear()
+        response, queries = self.get_me()
+        self.assertEqual(response.data['username'], self.user.username)
+        self.assertEqual(queries, 0)
+
+    def test_logout_resets_cache(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivation_resets_cache(self):
+        self.get_me()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, 401)
+
+    def test_cache_holds_no_account_fields(self):
+        self.get_me()
+        data = get_cache().get(cache_key(self.token.key))
+        self.assertEqual(data, (self.user.pk, True, self.token.key))
+
+    def test_user_loaded_lazily(self):
+        self.get_me()
+        local_tokens.clear()
+        user, token = CachedTokenAuthentication().authenticate_credentials(
+            self.token.key
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertTrue(user.is_authenticated)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, self.user.username)
+        self.assertIsInstance(user, User)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_short_timeout_for_process_cache(self):
+        self.assertEqual(cache_timeout(get_cache()), LOCAL_TTL)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': tempfile.mkdtemp(),
+        }}):
+            self.assertEqual(cache_timeout(get_cache()), TOKEN_TIMEOUT)
+
+    def test_cached_user_can_write(self):
+        recipe = self.create_recipe('Рецепт')
+        self.get_me()
+        response = self.client.patch(
+            f'/api/v1/recipes/{recipe.pk}/', {'name': 'Новое название'},
+            format='json', HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['author']['id'], self.user.pk)
@@ -1,4 +1,8 @@
 from django.contrib.auth import get_user_model
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status
@@ -6,69 +10,99 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from recipes.paginator import CustomPagePaginator
-from .models import Subscribe
+from foodgram.metrics import MetricsMixin
+from recipes import toggles
+from recipes.models import Recipe
+from recipes.paginator import KeysetPagePaginator
+
 from .permissions import CustomPermission
-from .serializers import SubscribeSerializer, UserSerializer
+from .serializers import RECIPES_LIMIT, SubscribeSerializer, UserSerializer
 
 User = get_user_model()
 
 
-class UsersViewSet(UserViewSet):
-    pagination_class = CustomPagePaginator
+def top_recipes(author_ids, limit):
+    """
+    Последние limit рецептов каждого из авторов одним запросом:
+    ROW_NUMBER() по автору во вложенном запросе. Нумеруются только
+    рецепты авторов текущей страницы.
+    """
+    ranked = Recipe.objects.filter(
+        author_id__in=author_ids
+    ).annotate(row_number=Window(
+        expression=RowNumber(),
+        partition_by=F('author_id'),
+        order_by=F('id').desc()
+    )).values('id', 'row_number')
+    sql, params = ranked.query.sql_with_params()
+    return Recipe.objects.filter(id__in=RawSQL(
+        f'SELECT ranked.id FROM ({sql}) ranked '
+        'WHERE ranked.row_number <= %s',
+        params + (limit,)
+    ))
+
+
+class UsersViewSet(MetricsMixin, UserViewSet):
+    pagination_class = KeysetPagePaginator
     serializer_class = UserSerializer
     permission_classes = (CustomPermission,)
 
+    def get_serializer_class(self):
+        if self.action == 'subscriptions':
+            return SubscribeSerializer
+        return super().get_serializer_class()
+
     @action(detail=True,
             permission_classes=[IsAuthenticated],
             methods=['GET', 'DELETE'],
             url_path='subscribe')
     def subscribe(self, request, id=None):
-        user = get_object_or_404(User, id=id)
-        if user == request.user:
+        if not str(id).isdigit():
+            raise Http404
+        if int(id) == request.user.pk:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
                 data={'errors': "You can't subscribe to yourself"}
             )
-        exists = Subscribe.objects.filter(
-            subscriber=request.user,
-            author=user
-        ).exists()
         if request.method == 'GET':
-            if exists:
+            user = get_object_or_404(User, id=id)
+            if not toggles.subscriptions.add(request.user.pk, [user.pk]):
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
                     data={'errors': 'Already subscribed'}
                 )
-            Subscribe.objects.create(subscriber=request.user, author=user)
             context = {'request': request}
             serializer = SubscribeSerializer(user, context=context)
             return Response(serializer.data)
-        else:
-            if not exists:
-                return Response(
-                    status=status.HTTP_400_BAD_REQUEST,
-                    data={'errors': 'Not subscribed'}
-                )
-            Subscribe.objects.filter(
-                subscriber=request.user,
-                author=user
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        if not toggles.subscriptions.remove(request.user.pk, [int(id)]):
+            get_object_or_404(User, id=id)
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'errors': 'Not subscribed'}
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             permission_classes=[IsAuthenticated],
             methods=['get'],
             url_path='subscriptions')
     def subscriptions(self, request):
-        subs = Subscribe.objects.all().filter(
-            subscriber=request.user.pk
-        ).values_list('author_id', flat=True).distinct()
-        context = {'request': request}
-        queryset = self.get_queryset().filter(id__in=subs)
+        limit = request.query_params.get('recipes_limit', '')
+        limit = int(limit) if limit.isdigit() else RECIPES_LIMIT
+        queryset = self.get_queryset().filter(
+            authors__subscriber=request.user
+        ).order_by('-id')
         page = self.paginate_queryset(queryset)
+        authors = list(queryset) if page is None else page
+        # рецепты загружаются после разбиения: только для этой страницы
+        prefetch_related_objects(authors, Prefetch(
+            'recipes',
+            queryset=top_recipes(
+                [author.pk for author in authors], limit
+            ).order_by('-id'),
+            to_attr='top_recipes'
+        ))
+        serializer = self.get_serializer(authors, many=True)
         if page is not None:
-            serializer = SubscribeSerializer(page, many=True, context=context)
             return self.get_paginated_response(serializer.data)
-        serializer = SubscribeSerializer(queryset, many=True, context=context)
         return Response(serializer.data)